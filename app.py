@@ -1,17 +1,29 @@
+import os
+import time
+from functools import wraps
+
 import dash
 from dash import dcc, html
 from dash.dependencies import Input, Output
-from data_processing import load_data, process_operations_data, process_portfolio_data
-from dashboard import dashboard_layout
+from dash.exceptions import PreventUpdate
+from flask import g, jsonify, request, Response
+from data_processing import (select_accounts, summarize_operations, summarize_portfolio,
+                             selection_money_weighted_return, YEARS)
+from query_layer import create_backend
+from metrics import METRICS_ENABLED, observe, timed, render_prometheus
+from refresh import DatasetRefresher
+from result_store import create_store, get_or_compute, store_key
+from dashboard import (dashboard_layout, loading_layout, section_visible_id, kpi_values, KPI_IDS, cached_figure,
+                       sunburst_figure, input_output_figure, payments_figure, treemap_figure, asset_figure)
 
 app = dash.Dash(__name__, suppress_callback_exceptions=True)
 
-df_operations, df_portfolio = load_data()
-(total_taxes, total_commissions, payments_analytics, input_output_yearly, operations_summary) = process_operations_data(df_operations)
-(detailed_data, sunburst_data, treemap_data, total_portfolio_value, total_profitability,
- grouped_data) = process_portfolio_data(df_portfolio)
-
-broker_accounts = df_portfolio['portfolio_name'].unique()
+# Общее для всех воркеров хранилище: каталог, memory или redis://
+result_store = create_store(os.getenv('RESULT_STORE_URL', 'data/.result_store'))
+# Агрегаты собираются и пересобираются в фоне, сервер отвечает ещё до окончания первой сборки
+query_backend = create_backend()
+refresher = DatasetRefresher(result_store, query_backend=query_backend)
+DATASET_WAIT_MS = 1000
 
 
 app.index_string = '''
@@ -34,47 +46,254 @@ app.index_string = '''
 '''
 
 
-app.layout = html.Div([
-    dcc.Location(id='url', refresh=False),
-    html.Div(id='page-content', children=dashboard_layout(
-        total_portfolio_value, total_profitability, operations_summary,
-        total_taxes, total_commissions, payments_analytics,
-        input_output_yearly, sunburst_data, treemap_data, grouped_data,
-        broker_accounts, broker_accounts[0]
-    ))
-])
+def current_layout(dataset):
+    if dataset is None:
+        return loading_layout()
+    broker_accounts = dataset['broker_accounts']
+    return dashboard_layout(broker_accounts, broker_accounts[0], month_bounds=dataset['time_index'].bounds)
 
 
-@app.callback(
-    Output('page-content', 'children'),
-    [Input('broker-filter-dashboard', 'value')]
-)
-def update_dashboard(selected_accounts):
+def serve_layout():
+    # Layout строится при каждой загрузке страницы, чтобы список счетов брался из текущего набора данных.
+    # Пока первая сборка не закончилась, страница показывает заглушку и опрашивает сервер
+    dataset = refresher.current
+    return html.Div([
+        dcc.Location(id='url', refresh=False),
+        dcc.Interval(id='dataset-wait', interval=DATASET_WAIT_MS, disabled=dataset is not None),
+        html.Div(id='page-content', children=current_layout(dataset))
+    ])
+
+
+app.layout = serve_layout
+
+
+@app.server.before_request
+def ensure_refresher():
+    # Поток обновления запускается в процессе, который обслуживает запросы, а не при импорте: app импортируют
+    # и мастер gunicorn --preload, и воркеры пула параллельной агрегации, которым он не нужен
+    refresher.start()
+
+
+@app.server.route('/metrics')
+def metrics():
+    last_refresh = refresher.last_refresh or 0
+    return Response(
+        render_prometheus() + f"dashboard_last_refresh_timestamp_seconds {last_refresh:.3f}\n",
+        mimetype='text/plain; version=0.0.4'
+    )
+
+
+@app.server.route('/status')
+def status():
+    return jsonify(refresher.status())
+
+
+if METRICS_ENABLED:
+    # Время всего запроса callback и время после выхода из callback (сериализация ответа в JSON)
+    @app.server.before_request
+    def start_request_timer():
+        g.request_started_at = time.perf_counter()
+
+    @app.server.after_request
+    def record_request_time(response):
+        if request.path == '/_dash-update-component' and 'request_started_at' in g:
+            finished_at = time.perf_counter()
+            observe('request', finished_at - g.request_started_at)
+            if 'callback_finished_at' in g:
+                observe('serialization', finished_at - g.callback_finished_at)
+        return response
+
+
+def timed_callback(function):
+    if not METRICS_ENABLED:
+        return function
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        g.callback_finished_at = time.perf_counter()
+        observe(f'callback_{function.__name__}', g.callback_finished_at - start)
+        return result
+    return wrapper
+
+
+def selection_key(selected_accounts, dataset):
     if not selected_accounts:
-        selected_accounts = [broker_accounts[0]]
-    filtered_portfolio = df_portfolio[df_portfolio['portfolio_name'].isin(selected_accounts)]
-    filtered_operations = df_operations[df_operations['portfolio_name'].isin(selected_accounts)]
+        selected_accounts = [dataset['broker_accounts'][0]]
+    elif isinstance(selected_accounts, str):
+        selected_accounts = [selected_accounts]
+    return tuple(sorted(selected_accounts))
 
+
+def selection_month_range(month_range, dataset):
+    # Диапазон на всё окно лет считается как отсутствие фильтра и делит расчёт с графиками портфеля
+    bounds = dataset['time_index'].bounds
+    if not month_range or bounds is None:
+        return None
+    start, end = max(int(month_range[0]), bounds[0]), min(int(month_range[1]), bounds[1])
+    if (start, end) == bounds:
+        return None
+    return start, end
+
+
+def selection_cubes(dataset, selected_accounts, month_range=None):
+    # Диапазон месяцев считается по префиксным суммам; с SQL-слоем фильтр по счетам и годам уходит в запрос,
+    # иначе выбираются строки готовых кубов
+    if query_backend is not None:
+        portfolio_cube = query_backend.portfolio_cube(selected_accounts, dataset['version'])
+    else:
+        portfolio_cube = select_accounts(dataset['portfolio_cube'], selected_accounts)
+    if month_range is not None:
+        operations_cube = dataset['time_index'].range_cube(selected_accounts, *month_range)
+    elif query_backend is not None:
+        operations_cube = query_backend.operations_cube(selected_accounts, YEARS, dataset['version'])
+    else:
+        operations_cube = select_accounts(dataset['operations_cube'], selected_accounts)
+    return operations_cube, portfolio_cube
+
+
+def _compute_selection(dataset, selected_accounts, month_range=None):
+    operations_cube, portfolio_cube = selection_cubes(dataset, selected_accounts, month_range)
     (total_taxes, total_commissions, payments_analytics, input_output_yearly,
-     operations_summary) = process_operations_data(filtered_operations)
+     operations_summary) = summarize_operations(operations_cube)
     (detailed_data, sunburst_data, treemap_data, total_portfolio_value, total_profitability,
-     grouped_data) = process_portfolio_data(filtered_portfolio)
-
-    return dashboard_layout(
-        total_portfolio_value,
-        total_profitability,
-        operations_summary,
-        total_taxes,
-        total_commissions,
-        payments_analytics,
-        input_output_yearly,
-        sunburst_data,
-        treemap_data,
-        grouped_data,
-        broker_accounts,
-        selected_accounts
+     grouped_data) = summarize_portfolio(portfolio_cube)
+
+    # XIRR одного счёта уже посчитан батчем при загрузке, для набора счетов решается по их общим потокам
+    if len(selected_accounts) == 1:
+        money_weighted_return = dataset['account_returns'].get(selected_accounts[0], float('nan'))
+    else:
+        money_weighted_return = selection_money_weighted_return(
+            select_accounts(dataset['cash_flows'], selected_accounts), total_portfolio_value,
+            dataset['valuation_date']
+        )
+
+    return {
+        'total_taxes': total_taxes,
+        'total_commissions': total_commissions,
+        'payments_analytics': payments_analytics,
+        'input_output_yearly': input_output_yearly,
+        'operations_summary': operations_summary,
+        'sunburst_data': sunburst_data,
+        'treemap_data': treemap_data,
+        'total_portfolio_value': total_portfolio_value,
+        'total_profitability': total_profitability,
+        'grouped_data': grouped_data,
+        'money_weighted_return': money_weighted_return,
+    }
+
+
+@timed('compute_selection')
+def compute_selection(selected_accounts, month_range=None):
+    # Все callback одного выбора счетов во всех воркерах используют один общий расчёт.
+    # Снимок набора данных берётся один раз, фоновая подмена не влияет на уже идущий расчёт
+    dataset = refresher.current
+    if dataset is None:
+        raise PreventUpdate
+    selected_accounts = selection_key(selected_accounts, dataset)
+    month_range = selection_month_range(month_range, dataset)
+    return get_or_compute(
+        result_store, store_key('selection', dataset['version'], selected_accounts, month_range),
+        lambda: _compute_selection(dataset, selected_accounts, month_range)
+    )
+
+
+@app.callback(
+    [Output('page-content', 'children'), Output('dataset-wait', 'disabled')],
+    [Input('dataset-wait', 'n_intervals')],
+    prevent_initial_call=True
+)
+def wait_for_dataset(n_intervals):
+    dataset = refresher.current
+    if dataset is None:
+        raise PreventUpdate
+    return current_layout(dataset), True
+
+
+def require_visible(visible):
+    # Графики секции строятся только после того, как браузер отметил её видимой
+    if not visible:
+        raise PreventUpdate
+
+
+@app.callback(
+    [Output(kpi_id, 'children') for kpi_id in KPI_IDS],
+    [Input('broker-filter-dashboard', 'value'), Input('date-range', 'value')]
+)
+@timed_callback
+def update_kpis(selected_accounts, month_range):
+    selection = compute_selection(selected_accounts, month_range)
+    return kpi_values(
+        selection['total_portfolio_value'],
+        selection['total_profitability'],
+        selection['operations_summary'],
+        selection['total_taxes'],
+        selection['total_commissions'],
+        selection['money_weighted_return']
     )
 
 
+@app.callback(Output('sunburst-graph', 'figure'),
+              [Input('broker-filter-dashboard', 'value'), Input(section_visible_id('overview'), 'data')])
+@timed_callback
+def update_sunburst(selected_accounts, visible):
+    require_visible(visible)
+    return cached_figure('sunburst', compute_selection(selected_accounts)['sunburst_data'], sunburst_figure)
+
+
+@app.callback(Output('input-output-graph', 'figure'),
+              [Input('broker-filter-dashboard', 'value'), Input(section_visible_id('overview'), 'data'),
+               Input('date-range', 'value')])
+@timed_callback
+def update_input_output(selected_accounts, visible, month_range):
+    require_visible(visible)
+    return cached_figure('input_output', compute_selection(selected_accounts, month_range)['input_output_yearly'],
+                         input_output_figure)
+
+
+@app.callback(Output('payments-graph', 'figure'),
+              [Input('broker-filter-dashboard', 'value'), Input(section_visible_id('overview'), 'data'),
+               Input('date-range', 'value')])
+@timed_callback
+def update_payments(selected_accounts, visible, month_range):
+    require_visible(visible)
+    return cached_figure('payments', compute_selection(selected_accounts, month_range)['payments_analytics'],
+                         payments_figure)
+
+
+@app.callback(Output('treemap-graph', 'figure'),
+              [Input('broker-filter-dashboard', 'value'), Input(section_visible_id('treemap'), 'data')])
+@timed_callback
+def update_treemap(selected_accounts, visible):
+    require_visible(visible)
+    return cached_figure('treemap', compute_selection(selected_accounts)['treemap_data'], treemap_figure)
+
+
+@app.callback(Output('share-graph', 'figure'),
+              [Input('broker-filter-dashboard', 'value'), Input(section_visible_id('assets'), 'data')])
+@timed_callback
+def update_share_graph(selected_accounts, visible):
+    require_visible(visible)
+    return asset_figure(compute_selection(selected_accounts)['grouped_data'], 'share', 'акций')
+
+
+@app.callback(Output('bond-graph', 'figure'),
+              [Input('broker-filter-dashboard', 'value'), Input(section_visible_id('assets'), 'data')])
+@timed_callback
+def update_bond_graph(selected_accounts, visible):
+    require_visible(visible)
+    return asset_figure(compute_selection(selected_accounts)['grouped_data'], 'bond', 'облигаций')
+
+
+@app.callback(Output('etf-graph', 'figure'),
+              [Input('broker-filter-dashboard', 'value'), Input(section_visible_id('assets'), 'data')])
+@timed_callback
+def update_etf_graph(selected_accounts, visible):
+    require_visible(visible)
+    return asset_figure(compute_selection(selected_accounts)['grouped_data'], 'etf', 'ETF')
+
+
 if __name__ == '__main__':
+    refresher.start()
     app.run_server(debug=False)
@@ -0,0 +1,38 @@
+// Ленивая загрузка графиков: секция с классом lazy-section получает флаг видимости,
+// когда впервые попадает в область просмотра, и только тогда срабатывают её callback
+(function () {
+    var seen = new WeakSet();
+
+    function markVisible(element) {
+        var storeId = element.getAttribute('data-section') + '-visible';
+        if (window.dash_clientside && window.dash_clientside.set_props) {
+            window.dash_clientside.set_props(storeId, {data: true});
+        }
+    }
+
+    var observer = 'IntersectionObserver' in window ? new IntersectionObserver(function (entries) {
+        entries.forEach(function (entry) {
+            if (entry.isIntersecting) {
+                observer.unobserve(entry.target);
+                markVisible(entry.target);
+            }
+        });
+    }, {rootMargin: '200px'}) : null;
+
+    function observeSections() {
+        document.querySelectorAll('.lazy-section').forEach(function (element) {
+            if (seen.has(element)) {
+                return;
+            }
+            seen.add(element);
+            if (observer) {
+                observer.observe(element);
+            } else {
+                markVisible(element);
+            }
+        });
+    }
+
+    // Каркас страницы рендерится после загрузки скрипта и заново при подмене page-content
+    new MutationObserver(observeSections).observe(document.documentElement, {childList: true, subtree: true});
+})();
@@ -0,0 +1,257 @@
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pandas as pd
+
+# Скрипты выгрузки лежат в data/ и импортируют соседние модули по имени
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data'))
+
+import api  # noqa: E402
+import prices  # noqa: E402
+from instrument_cache import InstrumentCache  # noqa: E402
+from rate_limiter import RateLimiter  # noqa: E402
+
+
+class ResourceExhausted(Exception):
+    # Как grpc-ошибка клиента: код с именем RESOURCE_EXHAUSTED
+    code = SimpleNamespace(name='RESOURCE_EXHAUSTED')
+
+
+class FakeServer:
+    # Локальная имитация API: задержка ответа, квота запросов за скользящую секунду,
+    # сверх которой запрос отклоняется с RESOURCE_EXHAUSTED
+    def __init__(self, latency=0.02, quota_rps=0, seed=0):
+        self.latency = latency
+        self.quota_rps = quota_rps
+        self.calls = 0
+        self.throttled = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._window = deque()
+        self._random = random.Random(seed)
+
+    async def request(self, result):
+        self.calls += 1
+        now = time.monotonic()
+        while self._window and now - self._window[0] >= 1:
+            self._window.popleft()
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency * self._random.uniform(0.5, 1.5))
+            if self.quota_rps and len(self._window) >= self.quota_rps:
+                self.throttled += 1
+                raise ResourceExhausted('StatusCode.RESOURCE_EXHAUSTED')
+            self._window.append(now)
+            return result
+        finally:
+            self.in_flight -= 1
+
+
+def money(value, currency='rub'):
+    units = int(value)
+    return SimpleNamespace(units=units, nano=round((value - units) * 1_000_000_000), currency=currency)
+
+
+class FakeAsyncClient:
+    # Повторяет те методы tinkoff.invest.AsyncClient, которые вызывает data/api.py
+    def __init__(self, server, n_accounts, n_operations, n_positions):
+        self.server = server
+        start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+        self.accounts = [SimpleNamespace(id=str(1000 + i), name=f'Счёт {i}') for i in range(n_accounts)]
+        # Каждая третья операция — покупка одной из бумаг портфеля, остальные — пополнения
+        self.account_operations = {
+            account.id: [SimpleNamespace(id=f'{account.id}-{j}', date=start + timedelta(hours=j), payment=money(-100 - j),
+                                         type='Покупка ценных бумаг' if j % 3 == 0 else 'Пополнение брокерского счёта',
+                                         figi=f'FIGI{j % n_positions}' if j % 3 == 0 else '',
+                                         quantity=1 if j % 3 == 0 else 0)
+                         for j in range(n_operations)]
+            for account in self.accounts
+        }
+        self.positions = [SimpleNamespace(figi=f'FIGI{j}', instrument_type='share', quantity=money(j + 1),
+                                          average_position_price=money(10.5), current_price=money(11.25),
+                                          expected_yield=money(0.75 * (j + 1)))
+                          for j in range(n_positions)]
+        self.users = SimpleNamespace(get_accounts=self.get_accounts)
+        self.operations = SimpleNamespace(get_operations=self.get_operations, get_portfolio=self.get_portfolio)
+        self.instruments = SimpleNamespace(get_instrument_by=self.get_instrument_by)
+        self.market_data = SimpleNamespace(get_candles=self.get_candles)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def get_accounts(self):
+        return self.server.request(SimpleNamespace(accounts=self.accounts))
+
+    def get_operations(self, account_id, from_=None):
+        operations = [operation for operation in self.account_operations[account_id]
+                      if from_ is None or operation.date >= from_]
+        return self.server.request(SimpleNamespace(operations=operations))
+
+    def get_portfolio(self, account_id):
+        return self.server.request(SimpleNamespace(positions=self.positions))
+
+    def get_instrument_by(self, id_type, id):
+        return self.server.request(SimpleNamespace(instrument=SimpleNamespace(ticker=f'T{id}', isin=f'RU{id}',
+                                                                              name=f'Инструмент {id}')))
+
+    def get_candles(self, figi, from_, to, interval):
+        days = pd.date_range(pd.Timestamp(from_).normalize(), to, freq='D', inclusive='left')
+        candles = [SimpleNamespace(time=day.to_pydatetime(), close=money(100 + day.dayofyear / 100)) for day in days]
+        return self.server.request(SimpleNamespace(candles=candles))
+
+
+async def check_concurrency(max_concurrent, calls=50):
+    server = FakeServer(latency=0.02)
+    limiter = RateLimiter(rate=10_000, capacity=10_000, max_concurrent=max_concurrent)
+    await asyncio.gather(*(limiter.call(server.request, result=i) for i in range(calls)))
+    assert server.max_in_flight <= max_concurrent, server.max_in_flight
+    assert limiter.metrics()['requests'] == calls
+    return server.max_in_flight
+
+
+async def check_rate(rate, capacity, calls=40):
+    server = FakeServer(latency=0.001)
+    limiter = RateLimiter(rate=rate, capacity=capacity, max_concurrent=calls)
+    start = time.monotonic()
+    await asyncio.gather(*(limiter.call(server.request, result=i) for i in range(calls)))
+    elapsed = time.monotonic() - start
+    # Первые capacity запросов уходят всплеском, остальные не быстрее rate в секунду
+    assert elapsed >= (calls - capacity) / rate * 0.95, elapsed
+    metrics = limiter.metrics()
+    assert metrics['wait_time'] > 0
+    return elapsed, metrics
+
+
+async def check_backoff(failures):
+    attempts = []
+
+    async def flaky():
+        attempts.append(time.monotonic())
+        if len(attempts) <= failures:
+            raise ResourceExhausted('StatusCode.RESOURCE_EXHAUSTED')
+        return 'ok'
+
+    limiter = RateLimiter(rate=100, capacity=10, max_concurrent=1, max_retries=failures, base_delay=0.01)
+    assert await limiter.call(flaky) == 'ok'
+    metrics = limiter.metrics()
+    assert metrics['throttles'] == failures and metrics['requests'] == failures + 1, metrics
+    assert metrics['rate'] < 100 and metrics['capacity'] < 10, metrics
+    assert metrics['wait_time'] > 0
+
+    # Попытки кончились — исключение уходит вызывающему, остальные ошибки не повторяются
+    attempts.clear()
+    limiter = RateLimiter(rate=100, capacity=10, max_concurrent=1, max_retries=failures - 1, base_delay=0.01)
+    try:
+        await limiter.call(flaky)
+    except ResourceExhausted:
+        pass
+    else:
+        raise AssertionError('ожидался RESOURCE_EXHAUSTED после исчерпания попыток')
+    assert limiter.metrics()['requests'] == failures
+
+    async def broken():
+        raise ValueError('не лимит')
+
+    limiter = RateLimiter(rate=100, capacity=10, max_concurrent=1, base_delay=0.01)
+    try:
+        await limiter.call(broken)
+    except ValueError:
+        pass
+    assert limiter.metrics()['requests'] == 1 and limiter.metrics()['throttles'] == 0
+    return metrics
+
+
+async def run_fetch(server, client, args, full_resync):
+    api.AsyncClient = lambda token: client
+    limiter = RateLimiter(rate=args.rps, capacity=args.burst, max_concurrent=args.concurrency, base_delay=0.05)
+    instrument_cache = InstrumentCache('instruments.sqlite')
+    calls_before = server.calls
+    start = time.perf_counter()
+    try:
+        await api.fetch_all(limiter, instrument_cache, full_resync)
+    finally:
+        instrument_cache.close()
+    elapsed = time.perf_counter() - start
+    # Каждый вызов сервера прошёл через ограничитель, одновременных запросов не больше заданного
+    assert server.calls - calls_before == limiter.metrics()['requests']
+    assert server.max_in_flight <= args.concurrency, server.max_in_flight
+    return elapsed, limiter
+
+
+async def run_prices(args):
+    limiter = RateLimiter(rate=args.rps, capacity=args.burst, max_concurrent=args.concurrency, base_delay=0.05)
+    await prices.fetch_prices(limiter)
+
+
+def check_fetch_all(args):
+    server = FakeServer(latency=args.latency, quota_rps=args.quota_rps)
+    client = FakeAsyncClient(server, args.accounts, args.operations, args.positions)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            full = asyncio.run(run_fetch(server, client, args, full_resync=True))
+            operations = pd.read_csv('operations.csv', dtype={'id': str})
+            portfolio = pd.read_csv('portfolio.csv')
+            assert len(operations) == args.accounts * args.operations, len(operations)
+            assert operations['id'].is_unique
+            assert len(portfolio) == args.accounts * args.positions, len(portfolio)
+            assert not os.path.exists('.fetch_run')
+
+            # Повторная выгрузка инкрементальная: старые операции не дублируются, инструменты берутся из кэша
+            incremental = asyncio.run(run_fetch(server, client, args, full_resync=False))
+            assert len(pd.read_csv('operations.csv', dtype={'id': str})) == len(operations)
+
+            # Цены закрытия для valuation.py: по одной строке на день для каждой купленной бумаги,
+            # повторная выгрузка дописывает только последний день
+            prices.AsyncClient = lambda token: client
+            asyncio.run(run_prices(args))
+            price_history = pd.read_csv(prices.PRICES_PATH)
+            assert set(price_history['figi']) == set(operations['figi'].dropna())
+            assert not price_history.duplicated(['date', 'figi']).any()
+            asyncio.run(run_prices(args))
+            assert len(pd.read_csv(prices.PRICES_PATH)) == len(price_history)
+        finally:
+            os.chdir(cwd)
+    return server, full, incremental
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Выгрузка через ограничитель запросов против имитации API')
+    parser.add_argument('--accounts', type=int, default=6)
+    parser.add_argument('--operations', type=int, default=200, help='операций на счёт')
+    parser.add_argument('--positions', type=int, default=30, help='позиций на счёт')
+    parser.add_argument('--latency', type=float, default=0.02, help='средняя задержка ответа, с')
+    parser.add_argument('--quota-rps', type=int, default=15, help='квота сервера, запросов в секунду (0 — без квоты)')
+    parser.add_argument('--rps', type=float, default=20, help='скорость ограничителя')
+    parser.add_argument('--burst', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"Одновременных запросов при лимите 5: {asyncio.run(check_concurrency(5))}")
+    elapsed, metrics = asyncio.run(check_rate(rate=20, capacity=5))
+    print(f"40 запросов при 20/с и всплеске 5: {elapsed:.2f} с, ожидание {metrics['wait_time']:.2f} с")
+    metrics = asyncio.run(check_backoff(3))
+    print(f"3 ответа RESOURCE_EXHAUSTED: скорость {metrics['rate']:.1f}/с, корзина {metrics['capacity']}, "
+          f"ожидание {metrics['wait_time']:.2f} с")
+
+    server, (full_seconds, full), (incremental_seconds, incremental) = check_fetch_all(args)
+    print(f"Полная выгрузка: {full_seconds:.2f} с. {full.report()}")
+    print(f"Инкрементальная: {incremental_seconds:.2f} с. {incremental.report()}")
+    print(f"Сервер: {server.calls} запросов, отклонено {server.throttled}, одновременно до {server.max_in_flight}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import argparse
+import json
+import time
+
+import plotly
+
+from dashboard import dashboard_layout, section_visible_id, KPI_IDS
+
+# Графики и секции ленивой загрузки, в которых они лежат
+GRAPH_SECTIONS = {'sunburst-graph': 'overview', 'input-output-graph': 'overview', 'payments-graph': 'overview',
+                  'treemap-graph': 'treemap', 'share-graph': 'assets', 'bond-graph': 'assets', 'etf-graph': 'assets'}
+
+
+# Callback, которые зависят от диапазона дат
+DATE_RANGE_OUTPUTS = set(KPI_IDS) | {'input-output-graph', 'payments-graph'}
+
+
+def update_request(outputs, selected_accounts, month_range=None):
+    if len(outputs) == 1:
+        output = f"{outputs[0][0]}.{outputs[0][1]}"
+        outputs_payload = {'id': outputs[0][0], 'property': outputs[0][1]}
+    else:
+        output = '..' + '...'.join(f"{component_id}.{prop}" for component_id, prop in outputs) + '..'
+        outputs_payload = [{'id': component_id, 'property': prop} for component_id, prop in outputs]
+    inputs = [{'id': 'broker-filter-dashboard', 'property': 'value', 'value': list(selected_accounts)}]
+    if outputs[0][0] in GRAPH_SECTIONS:
+        # Секция графика считается уже видимой
+        inputs.append({'id': section_visible_id(GRAPH_SECTIONS[outputs[0][0]]), 'property': 'data', 'value': True})
+    if outputs[0][0] in DATE_RANGE_OUTPUTS:
+        inputs.append({'id': 'date-range', 'property': 'value', 'value': month_range})
+    return {
+        'output': output,
+        'outputs': outputs_payload,
+        'inputs': inputs,
+        'changedPropIds': ['broker-filter-dashboard.value'],
+    }
+
+
+def measure_selection(client, selected_accounts, month_range=None):
+    requests = [[(kpi_id, 'children') for kpi_id in KPI_IDS]] + [[(graph_id, 'figure')] for graph_id in GRAPH_SECTIONS]
+    responses = []
+    for outputs in requests:
+        start = time.perf_counter()
+        response = client.post('/_dash-update-component', json=update_request(outputs, selected_accounts, month_range))
+        elapsed = time.perf_counter() - start
+        assert response.status_code == 200, response.data[:500]
+        responses.append({'outputs': [component_id for component_id, _ in outputs],
+                          'bytes': len(response.data), 'seconds': elapsed})
+    return responses
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Размер и время ответов callback дашборда')
+    parser.add_argument('--accounts', type=int, default=2, help='сколько счетов выбирать')
+    args = parser.parse_args()
+
+    # Запускать из каталога, где лежит data/ с operations.csv и portfolio.csv
+    from app import app, refresher
+
+    refresher.start().wait()
+    broker_accounts = refresher.current['broker_accounts']
+
+    selected_accounts = list(broker_accounts[:args.accounts])
+    client = app.server.test_client()
+    client.get('/_dash-layout')
+
+    responses = measure_selection(client, selected_accounts)
+    after_bytes = sum(response['bytes'] for response in responses)
+    # Раньше один callback возвращал весь каркас страницы вместе со всеми фигурами
+    layout_bytes = len(json.dumps(dashboard_layout(broker_accounts, selected_accounts),
+                                  cls=plotly.utils.PlotlyJSONEncoder))
+
+    for response in responses:
+        print(f"{', '.join(response['outputs']):<90} {response['bytes']:>10} байт {response['seconds'] * 1000:>8.1f} мс")
+    print(f"Все ответы одного выбора: {after_bytes} байт")
+    print(f"Прежний ответ page-content: ~{after_bytes + layout_bytes} байт (каркас {layout_bytes} байт)")
+    repeated = measure_selection(client, selected_accounts)
+    print(f"Повторный выбор: {sum(response['seconds'] for response in repeated) * 1000:.1f} мс на все ответы")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import time
+
+import plotly.io as pio
+
+import dashboard
+from benchmarks.synthetic import generate_portfolio
+from data_processing import add_portfolio_values, aggregate_portfolio, summarize_portfolio
+from schema import PORTFOLIO_DTYPES
+
+FULL_SETTINGS = {'TREEMAP_TOP_N': 0, 'WEBGL_THRESHOLD': float('inf'), 'POINT_TEXT_LIMIT': float('inf')}
+
+
+def measure(build, data, *args):
+    # Время построения и сериализации в JSON, как перед отправкой в браузер; отрисовку в браузере не видно
+    start = time.perf_counter()
+    payload = pio.to_json(build(data, *args), validate=False)
+    return len(payload.encode('utf-8')), time.perf_counter() - start
+
+
+def measure_figures(treemap_data, grouped_data):
+    results = {'treemap': measure(dashboard.treemap_figure, treemap_data)}
+    for asset_type in ['share', 'bond', 'etf']:
+        results[asset_type] = measure(dashboard.create_graph, grouped_data[grouped_data['type'] == asset_type],
+                                      asset_type)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Размер и время построения фигур при большом числе позиций')
+    parser.add_argument('--accounts', type=int, default=20)
+    parser.add_argument('--tickers', type=int, default=5000)
+    parser.add_argument('--positions', type=int, default=1000, help='позиций на счёт')
+    parser.add_argument('--budget-kb', type=float, default=500, help='целевой размер одной фигуры')
+    args = parser.parse_args()
+
+    portfolio = generate_portfolio(args.accounts, args.tickers, args.positions).astype(PORTFOLIO_DTYPES)
+    _, _, treemap_data, _, _, grouped_data = summarize_portfolio(aggregate_portfolio(add_portfolio_values(portfolio)))
+
+    budgeted = measure_figures(treemap_data, grouped_data)
+    saved = {name: getattr(dashboard, name) for name in FULL_SETTINGS}
+    for name, value in FULL_SETTINGS.items():
+        setattr(dashboard, name, value)
+    try:
+        full = measure_figures(treemap_data, grouped_data)
+    finally:
+        for name, value in saved.items():
+            setattr(dashboard, name, value)
+
+    print(f"Позиций: {len(portfolio)}, тикеров в treemap: {len(treemap_data)}, бюджет {args.budget_kb:.0f} КБ")
+    print(f"{'фигура':<10} {'КБ без бюджета':>16} {'мс':>8} {'КБ с бюджетом':>15} {'мс':>8}")
+    over_budget = []
+    for name in budgeted:
+        full_bytes, full_seconds = full[name]
+        budget_bytes, budget_seconds = budgeted[name]
+        print(f"{name:<10} {full_bytes / 1024:>16.1f} {full_seconds * 1000:>8.1f} "
+              f"{budget_bytes / 1024:>15.1f} {budget_seconds * 1000:>8.1f}")
+        if budget_bytes > args.budget_kb * 1024:
+            over_budget.append(name)
+    print(f"Сверх бюджета: {', '.join(over_budget)}" if over_budget else "Все фигуры в бюджете")
+
+
+if __name__ == '__main__':
+    main()
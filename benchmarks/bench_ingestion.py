@@ -0,0 +1,90 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.synthetic import generate_operations
+
+
+def peak_rss_mb():
+    # VmHWM считается заново после exec, а ru_maxrss наследует пик родительского процесса
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_child(mode, path, cube_path):
+    import data_processing
+
+    start = time.perf_counter()
+    if mode == 'full':
+        df_operations = data_processing.parse_operation_dates(
+            data_processing.pd.read_csv(path, dtype=data_processing.OPERATIONS_DTYPES)
+        )
+        df_operations = df_operations[df_operations['year'].isin(list(data_processing.YEARS))]
+        operations_cube = data_processing.aggregate_operations(df_operations)
+    else:
+        operations_cube, _ = data_processing.aggregate_operations_streaming(path)
+    seconds = time.perf_counter() - start
+    # Куб сохраняется для сверки значений в родительском процессе, пиковая память уже измерена
+    rss = peak_rss_mb()
+    operations_cube.to_pickle(cube_path)
+    print(json.dumps({'seconds': seconds, 'peak_rss_mb': rss}))
+
+
+def measure(mode, path):
+    cube_path = f'{path}.{mode}.pkl'
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.bench_ingestion', '--child', mode, path, cube_path],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return dict(json.loads(output.strip().splitlines()[-1]), cube_path=cube_path)
+
+
+def assert_same_cube(expected_path, actual_path):
+    # Порядок строк и суммирование по кускам могут отличаться: значения сверяются по ключам с допуском
+    cubes = []
+    for path in (expected_path, actual_path):
+        cube = pd.read_pickle(path)
+        keys = [column for column in cube.columns if column != 'amount']
+        cubes.append(cube.astype({key: object for key in keys}).set_index(keys)['amount'].sort_index())
+    pd.testing.assert_series_equal(cubes[0], cubes[1], rtol=1e-9)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Пиковая память при чтении operations.csv целиком и потоково')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10 ** 5, 10 ** 6, 5 * 10 ** 6])
+    parser.add_argument('--child', nargs=3, metavar=('MODE', 'PATH', 'CUBE_PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+        return
+
+    print(f"{'строк':>10} {'файл, МБ':>10} {'целиком, МБ':>12} {'потоково, МБ':>13} {'целиком, с':>11} {'потоково, с':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in args.rows:
+            path = os.path.join(directory, f'operations_{rows}.csv')
+            # Года шире окна дашборда, чтобы фильтр по годам что-то отбрасывал
+            generate_operations(rows, years=range(2016, 2026)).drop(columns=['year', 'month']).to_csv(
+                path, index=False)
+            full = measure('full', path)
+            streaming = measure('streaming', path)
+            assert_same_cube(full['cube_path'], streaming['cube_path'])
+            print(f"{rows:>10} {os.path.getsize(path) / 2 ** 20:>10.0f} {full['peak_rss_mb']:>12.0f} "
+                  f"{streaming['peak_rss_mb']:>13.0f} {full['seconds']:>11.2f} {streaming['seconds']:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+import argparse
+
+from benchmarks.synthetic import generate_operations
+from data_processing import YEARS
+from schema import OPERATIONS_DTYPES, YEAR_DTYPE, MONTH_DTYPE
+
+
+def frame_memory_mb(df):
+    return df.memory_usage(deep=True).sum() / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Память кадра операций до и после схемы типов')
+    parser.add_argument('--rows', type=int, default=10 ** 7)
+    args = parser.parse_args()
+
+    # Так кадр выглядел после pd.read_csv без dtype: строки object, числа int64/float64
+    before = generate_operations(args.rows, years=YEARS)
+    before['year'] = before['year'].astype('int64')
+    before['month'] = before['month'].astype('int64')
+    after = before.astype({column: dtype for column, dtype in OPERATIONS_DTYPES.items() if column in before.columns})
+    after['year'] = after['year'].astype(YEAR_DTYPE)
+    after['month'] = after['month'].astype(MONTH_DTYPE)
+
+    print(f"{'колонка':<16} {'тип до':>20} {'МБ до':>10} {'тип после':>20} {'МБ после':>10}")
+    before_usage = before.memory_usage(deep=True, index=False) / 2 ** 20
+    after_usage = after.memory_usage(deep=True, index=False) / 2 ** 20
+    for column in before.columns:
+        print(f"{column:<16} {str(before[column].dtype):>20} {before_usage[column]:>10.1f} "
+              f"{str(after[column].dtype):>20} {after_usage[column]:>10.1f}")
+    print(f"{'итого':<16} {'':>20} {frame_memory_mb(before):>10.1f} {'':>20} {frame_memory_mb(after):>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
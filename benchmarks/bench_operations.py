@@ -0,0 +1,80 @@
+import argparse
+import time
+import warnings
+
+import pandas as pd
+
+from benchmarks.synthetic import generate_operations
+from data_processing import process_operations_data
+
+
+def legacy_process_operations_data(df):
+    # Построчная реализация до векторизации, оставлена для сравнения
+    tax_types = [
+        'Удержание налога по дивидендам',
+        'Удержание налога',
+        'Корректировка налога',
+        'Удержание НДФЛ по купонам'
+    ]
+    commission_types = ['Удержание комиссии за операцию']
+
+    total_taxes = df[df['type'].isin(tax_types)]['amount'].sum()
+    total_commissions = df[df['type'].isin(commission_types)]['amount'].sum()
+
+    payments_df = df[df['type'].isin(['Выплата дивидендов', 'Выплата купонов'])]
+    payments_analytics = payments_df.groupby(['year', 'type'])['amount'].sum().reset_index()
+
+    input_output_df = df[df['type'].isin(['Пополнение брокерского счёта', 'Вывод денежных средств'])]
+    input_output_df['amount'] = input_output_df.apply(
+        lambda row: row['amount'] if row['type'] == 'Пополнение брокерского счёта' else -row['amount'], axis=1
+    )
+    input_output_yearly = input_output_df.groupby(['year', 'type', 'portfolio_name'])['amount'].sum().reset_index()
+    input_output_yearly['account'] = input_output_yearly['portfolio_name']
+
+    operations_summary = {
+        'total_coupons': payments_df[payments_df['type'] == 'Выплата купонов']['amount'].sum(),
+        'total_dividends': payments_df[payments_df['type'] == 'Выплата дивидендов']['amount'].sum(),
+        'total_deposits': input_output_df[input_output_df['type'] == 'Пополнение брокерского счёта']['amount'].sum(),
+        'total_withdrawals': -1 * input_output_df[input_output_df['type'] == 'Вывод денежных средств']['amount'].sum(),
+    }
+
+    return total_taxes, total_commissions, payments_analytics, input_output_yearly, operations_summary
+
+
+def check_parity(expected, actual):
+    for expected_item, actual_item in zip(expected, actual):
+        if isinstance(expected_item, pd.DataFrame):
+            pd.testing.assert_frame_equal(expected_item, actual_item, check_dtype=False)
+        elif isinstance(expected_item, dict):
+            pd.testing.assert_series_equal(pd.Series(expected_item), pd.Series(actual_item))
+        else:
+            assert abs(expected_item - actual_item) <= 1e-6 * max(1, abs(expected_item))
+
+
+def measure(function, df, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(df)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение process_operations_data с построчной реализацией')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10 ** 4, 10 ** 6, 10 ** 7])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    warnings.simplefilter('ignore', pd.errors.SettingWithCopyWarning)
+    print(f"{'строк':>10} {'было, с':>10} {'стало, с':>10} {'ускорение':>10}")
+    for size in args.sizes:
+        df = generate_operations(size)
+        legacy_time, expected = measure(legacy_process_operations_data, df, 1 if size > 10 ** 6 else args.repeat)
+        current_time, actual = measure(process_operations_data, df, args.repeat)
+        check_parity(expected, actual)
+        print(f"{size:>10} {legacy_time:>10.3f} {current_time:>10.3f} {legacy_time / current_time:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import argparse
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.synthetic import write_dataset
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Агрегация операций по счетам в пуле процессов и последовательно')
+    parser.add_argument('--rows', type=int, default=5 * 10 ** 6)
+    parser.add_argument('--accounts', type=int, default=30)
+    parser.add_argument('--workers', type=int, nargs='+', default=[2, 4, os.cpu_count() or 1])
+    args = parser.parse_args()
+    # Один воркер — это последовательный расчёт, пул для него не создаётся
+    workers_list = sorted({workers for workers in args.workers if workers >= 2})
+    if not workers_list:
+        parser.error('нужно хотя бы одно значение --workers не меньше 2')
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_dataset(directory, args.rows, args.accounts)
+        os.chdir(directory)
+        import data_processing
+
+        # Первое чтение собирает Feather-кэш, оба варианта дальше читают из него
+        data_processing.load_operations()
+        start = time.perf_counter()
+        df_history = data_processing.load_operations()
+        serial_cube = data_processing.aggregate_operations(data_processing.filter_years(df_history,
+                                                                                        data_processing.YEARS))
+        serial_flows = data_processing.aggregate_cash_flows(df_history)
+        serial = time.perf_counter() - start
+        print(f"Строк: {len(df_history)}, счетов: {args.accounts}, ядер: {os.cpu_count()}")
+        print(f"{'последовательно':<20} {serial:>8.3f} с")
+        del df_history
+
+        for workers in workers_list:
+            start = time.perf_counter()
+            cache_path, row_counts = data_processing.parallel_row_counts(workers, min_rows=0)
+            cube, flows = data_processing.aggregate_operations_parallel(cache_path, row_counts, workers=workers)
+            elapsed = time.perf_counter() - start
+            keys = ['portfolio_name', 'year', 'month', 'type']
+            pd.testing.assert_frame_equal(
+                cube.sort_values(keys, ignore_index=True), serial_cube.sort_values(keys, ignore_index=True),
+                check_dtype=False, check_categorical=False
+            )
+            pd.testing.assert_frame_equal(
+                flows.sort_values(['portfolio_name', 'date'], ignore_index=True),
+                serial_flows.sort_values(['portfolio_name', 'date'], ignore_index=True),
+                check_dtype=False, check_categorical=False
+            )
+            print(f"{f'воркеров {workers}':<20} {elapsed:>8.3f} с, ускорение {serial / elapsed:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
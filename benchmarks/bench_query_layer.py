@@ -0,0 +1,89 @@
+import argparse
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.run import best_of
+from benchmarks.synthetic import write_dataset
+
+
+def assert_same(left, right, keys):
+    # Сравнение без учёта порядка строк и точных типов: SQL возвращает int64/float64 и строки вместо категорий
+    left = left.sort_values(keys, ignore_index=True)
+    right = right.sort_values(keys, ignore_index=True)
+    pd.testing.assert_frame_equal(left.astype({key: object for key in keys}), right.astype({key: object for key in keys}),
+                                  check_dtype=False, check_categorical=False, check_like=True)
+
+
+def check_parity(data_processing, pandas_cubes, backend, accounts, years):
+    operations_cube = data_processing.filter_years(
+        data_processing.select_accounts(pandas_cubes[0], accounts), years
+    )
+    expected_operations = data_processing.summarize_operations(operations_cube)
+    actual_operations = data_processing.summarize_operations(backend.operations_cube(accounts, years, 'bench'))
+    for index, keys in ((2, ['year', 'type']), (3, ['year', 'type', 'portfolio_name'])):
+        assert_same(actual_operations[index], expected_operations[index], keys)
+    for index in (0, 1):
+        assert abs(actual_operations[index] - expected_operations[index]) < 1e-6
+    # Купоны, дивиденды, пополнения и выводы
+    assert actual_operations[4].keys() == expected_operations[4].keys()
+    for key, expected in expected_operations[4].items():
+        assert abs(actual_operations[4][key] - expected) <= 1e-6 * max(1, abs(expected)), key
+
+    expected_portfolio = data_processing.summarize_portfolio(
+        data_processing.select_accounts(pandas_cubes[1], accounts)
+    )
+    actual_portfolio = data_processing.summarize_portfolio(backend.portfolio_cube(accounts, 'bench'))
+    for index, keys in ((0, ['type']), (1, ['type', 'portfolio_name']), (2, ['sector', 'name']),
+                        (5, ['ticker', 'name', 'type'])):
+        assert_same(actual_portfolio[index], expected_portfolio[index], keys)
+    assert abs(actual_portfolio[3] - expected_portfolio[3]) < 1e-3 * max(1, abs(expected_portfolio[3]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сверка SQL-слоя с pandas и задержка выборок')
+    parser.add_argument('--rows', type=int, default=10 ** 6)
+    parser.add_argument('--accounts', type=int, default=10)
+    parser.add_argument('--backends', nargs='+', default=['sqlite', 'duckdb'])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_dataset(directory, args.rows, args.accounts, years=range(2018, 2025))
+        os.chdir(directory)
+        import data_processing
+        import query_layer
+
+        years = data_processing.YEARS
+        df_operations, df_portfolio = data_processing.load_data(range(2000, 2100))
+        pandas_cubes = data_processing.build_aggregates(df_operations, df_portfolio)
+        accounts = list(df_portfolio['portfolio_name'].unique())
+        selections = {'один счёт': accounts[:1], 'половина': accounts[:len(accounts) // 2 or 1], 'все': accounts}
+
+        def pandas_selection(selected):
+            data_processing.summarize_operations(data_processing.filter_years(
+                data_processing.select_accounts(pandas_cubes[0], selected), years))
+            data_processing.summarize_portfolio(data_processing.select_accounts(pandas_cubes[1], selected))
+
+        print(f"Строк: {len(df_operations)}, счетов: {len(accounts)}, окно лет {years.start}-{years.stop - 1}")
+        for name, selected in selections.items():
+            print(f"{'pandas':<8} {name:<10} {best_of(lambda: pandas_selection(selected), args.repeat) * 1000:>8.1f} мс")
+
+        for kind in args.backends:
+            backend = query_layer.create_backend(kind, os.path.join(directory, 'analytics'))
+            start = time.perf_counter()
+            backend.ensure('bench')
+            print(f"{type(backend).__name__}: загрузка таблиц {time.perf_counter() - start:.2f} с")
+            for name, selected in selections.items():
+                check_parity(data_processing, pandas_cubes, backend, selected, years)
+                seconds = best_of(lambda: (
+                    data_processing.summarize_operations(backend.operations_cube(selected, years, 'bench')),
+                    data_processing.summarize_portfolio(backend.portfolio_cube(selected, 'bench'))
+                ), args.repeat)
+                print(f"{kind:<8} {name:<10} {seconds * 1000:>8.1f} мс, результаты совпадают с pandas")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+import argparse
+import tempfile
+import threading
+import time
+
+import pandas as pd
+
+from result_store import MemoryStore, RedisStore, create_store, get_or_compute, store_key
+
+
+class FakeRedis:
+    # Имитация redis.Redis внутри процесса: байтовые значения, get, set с ex и expire
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.calls = {'get': 0, 'set': 0, 'expire': 0}
+        self._values = {}
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    def _alive(self, key):
+        expires = self._expires.get(key)
+        if expires is not None and self.clock() >= expires:
+            self._values.pop(key, None)
+            self._expires.pop(key, None)
+        return key in self._values
+
+    def get(self, key):
+        with self._lock:
+            self.calls['get'] += 1
+            return self._values[key] if self._alive(key) else None
+
+    def set(self, key, value, ex=None):
+        if not isinstance(value, bytes):
+            raise TypeError('значение Redis должно быть bytes')
+        with self._lock:
+            self.calls['set'] += 1
+            self._values[key] = value
+            if ex is None:
+                self._expires.pop(key, None)
+            else:
+                self._expires[key] = self.clock() + ex
+            return True
+
+    def expire(self, key, seconds):
+        with self._lock:
+            self.calls['expire'] += 1
+            if not self._alive(key):
+                return False
+            self._expires[key] = self.clock() + seconds
+            return True
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def sample_value(rows):
+    return {'frame': pd.DataFrame({'portfolio_name': ['Счёт'] * rows, 'amount': range(rows)}), 'total': rows}
+
+
+def check_roundtrip(store, value):
+    key = store_key('roundtrip', len(value['frame']))
+    assert store.get(key) is None
+    store.set(key, value)
+    restored = store.get(key)
+    assert restored['total'] == value['total']
+    pd.testing.assert_frame_equal(restored['frame'], value['frame'])
+
+
+def check_redis_ttl():
+    clock = Clock()
+    client = FakeRedis(clock)
+    store = RedisStore(client, ttl=60)
+    store.set('key', 1)
+    assert client.get('invest_dashboard:key') is not None
+    # Чтение продлевает TTL: значение живёт 60 секунд с последнего обращения
+    clock.now = 50
+    assert store.get('key') == 1 and client.calls['expire'] == 1
+    clock.now = 100
+    assert store.get('key') == 1
+    clock.now = 161
+    assert store.get('key') is None
+    assert client.calls['expire'] == 2
+
+
+def check_shared_computation(store, threads=8):
+    # Параллельные запросы одного выбора считаются один раз, остальные берут готовое значение
+    calls = []
+    barrier = threading.Barrier(threads)
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.05)
+        return 42
+
+    def request():
+        barrier.wait()
+        results.append(get_or_compute(store, store_key('shared', id(store)), compute))
+
+    results = []
+    workers = [threading.Thread(target=request) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert results == [42] * threads, results
+    assert len(calls) == 1, len(calls)
+
+
+def timed(store, value, repeat):
+    key = store_key('timed')
+    start = time.perf_counter()
+    for _ in range(repeat):
+        store.set(key, value)
+    written = time.perf_counter()
+    for _ in range(repeat):
+        store.get(key)
+    read = time.perf_counter()
+    return (written - start) / repeat, (read - written) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Хранилища результатов: память, файлы, Redis (имитация)')
+    parser.add_argument('--rows', type=int, default=10 ** 5, help='строк в сохраняемой таблице')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    value = sample_value(args.rows)
+    with tempfile.TemporaryDirectory() as directory:
+        redis_client = FakeRedis()
+        stores = {
+            'memory': create_store('memory'),
+            'file': create_store('file://' + directory),
+            'redis': create_store('redis://localhost:6379/0', redis_client=redis_client),
+        }
+        assert isinstance(stores['memory'], MemoryStore)
+        assert isinstance(stores['redis'], RedisStore) and stores['redis'].client is redis_client
+        check_redis_ttl()
+        for name, store in stores.items():
+            check_roundtrip(store, value)
+            check_shared_computation(store)
+            write_seconds, read_seconds = timed(store, value, args.repeat)
+            print(f"{name:<8} запись {write_seconds * 1000:8.2f} мс, чтение {read_seconds * 1000:8.2f} мс")
+        print(f"Вызовы Redis: {redis_client.calls}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import argparse
+import time
+
+import pandas as pd
+
+from benchmarks.synthetic import generate_operations, generate_price_history
+from valuation import ValuationEngine, to_day
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Скорость построения кривой стоимости портфеля')
+    parser.add_argument('--rows', type=int, default=10 ** 6)
+    parser.add_argument('--accounts', type=int, default=10)
+    parser.add_argument('--tickers', type=int, default=500)
+    parser.add_argument('--years', type=int, default=5)
+    args = parser.parse_args()
+
+    years = range(2025 - args.years, 2025)
+    operations = generate_operations(args.rows, args.accounts, years, n_tickers=args.tickers)
+    prices = generate_price_history(args.tickers, years)
+    prices['date'] = to_day(prices['date'])
+    prices = prices.pivot_table(index='date', columns='figi', values='close', aggfunc='last')
+
+    # Последние 30 дней приходят отдельной порцией, как после инкрементальной синхронизации:
+    # вместе с ними повторно приходят уже загруженные операции дня отметки
+    cutoff = operations['date'].max() - (operations['date'].max() - operations['date'].min()) / (args.years * 12)
+    history = operations[operations['date'] < cutoff]
+    update = operations[operations['date'] >= cutoff.normalize()]
+
+    start = time.perf_counter()
+    engine = ValuationEngine(prices)
+    engine.add_operations(history)
+    loaded = time.perf_counter()
+    curve = engine.equity_curve()
+    returns = engine.returns()
+    valued = time.perf_counter()
+    engine.add_operations(update)
+    engine.equity_curve()
+    engine.returns()
+    updated = time.perf_counter()
+
+    rebuilt = ValuationEngine(prices)
+    rebuilt.add_operations(operations)
+    pd.testing.assert_frame_equal(engine.equity_curve(), rebuilt.equity_curve(), rtol=1e-9)
+
+    print(f"Операций: {len(operations)}, счетов: {args.accounts}, тикеров: {args.tickers}, дней: {len(curve)}")
+    print(f"Загрузка операций: {loaded - start:.3f} с")
+    print(f"Кривая и доходности по всем счетам: {valued - loaded:.3f} с")
+    print(f"Добавление {len(update)} новых операций и пересчёт: {updated - valued:.3f} с")
+    print(f"TWR {returns['twr']:+.2%}, MWR {returns['mwr']:+.2%}")
+
+
+if __name__ == '__main__':
+    main()
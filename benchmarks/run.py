@@ -0,0 +1,116 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.synthetic import write_dataset
+
+# Строки операций, счета, тикеры
+SCALES = {
+    'small': (10 ** 4, 3, 50),
+    'medium': (10 ** 6, 10, 300),
+    'large': (5 * 10 ** 6, 30, 1000),
+}
+
+
+def best_of(function, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_child(directory, repeat):
+    # Каждый масштаб измеряется в отдельном процессе: app начинает загружать данные при импорте
+    os.chdir(directory)
+    os.environ['RESULT_STORE_URL'] = 'memory'
+
+    import data_processing
+    import dashboard
+
+    timings = {}
+    start = time.perf_counter()
+    df_operations, df_portfolio = data_processing.load_data()
+    timings['load_data_cold'] = time.perf_counter() - start
+    timings['load_data_cached'] = best_of(data_processing.load_data, repeat)
+    timings['process_operations_data'] = best_of(lambda: data_processing.process_operations_data(df_operations),
+                                                 repeat)
+    timings['process_portfolio_data'] = best_of(lambda: data_processing.process_portfolio_data(df_portfolio),
+                                                repeat)
+
+    accounts = list(df_portfolio['portfolio_name'].unique())
+    timings['dashboard_layout'] = best_of(lambda: dashboard.dashboard_layout(accounts, accounts[0]), repeat)
+
+    from benchmarks.bench_callbacks import measure_selection
+    from app import app, refresher
+
+    # Первая сборка набора данных идёт в фоне, до неё callback отвечают 204
+    refresher.start().wait()
+    client = app.server.test_client()
+    client.get('/_dash-layout')
+    selections = [accounts[:i + 1] for i in range(min(repeat, len(accounts)))]
+    # Первый проход по новым выборкам: расчёт и построение фигур; второй проход отдаётся из кэшей
+    timings['update_dashboard_cold'] = min(
+        sum(response['seconds'] for response in measure_selection(client, selection)) for selection in selections
+    )
+    timings['update_dashboard_cached'] = min(
+        sum(response['seconds'] for response in measure_selection(client, selection)) for selection in selections
+    )
+
+    print(json.dumps({
+        'operations_rows': len(df_operations),
+        'portfolio_rows': len(df_portfolio),
+        'accounts': len(accounts),
+        'seconds': timings,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк загрузки, агрегации и отрисовки дашборда')
+    parser.add_argument('--scales', nargs='+', default=['small', 'medium'], choices=list(SCALES))
+    parser.add_argument('--years', default='2018-2024')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.repeat)
+        return
+
+    start_year, _, end_year = args.years.partition('-')
+    years = range(int(start_year), int(end_year or start_year) + 1)
+    results = []
+    for scale in args.scales:
+        n_rows, n_accounts, n_tickers = SCALES[scale]
+        with tempfile.TemporaryDirectory() as directory:
+            write_dataset(directory, n_rows, n_accounts, n_tickers, years)
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.run', '--child', directory, '--repeat', str(args.repeat)],
+                check=True, capture_output=True, text=True
+            ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        result['scale'] = scale
+        results.append(result)
+        print(scale, json.dumps(result['seconds'], indent=2))
+
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump({
+            'created_at': pd.Timestamp.now(tz='UTC').isoformat(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'years': args.years,
+            'results': results,
+        }, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
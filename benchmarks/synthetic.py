@@ -0,0 +1,136 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_processing import (TAX_TYPES, COMMISSION_TYPES, COUPON_TYPE, DIVIDEND_TYPE, DEPOSIT_TYPE,
+                             WITHDRAWAL_TYPE)
+
+# Примерная доля каждого типа в реальной истории операций
+OPERATION_MIX = {
+    'Покупка ценных бумаг': 0.30,
+    'Продажа ценных бумаг': 0.12,
+    COMMISSION_TYPES[0]: 0.25,
+    COUPON_TYPE: 0.10,
+    DIVIDEND_TYPE: 0.05,
+    TAX_TYPES[0]: 0.03,
+    TAX_TYPES[1]: 0.02,
+    TAX_TYPES[2]: 0.01,
+    TAX_TYPES[3]: 0.02,
+    DEPOSIT_TYPE: 0.06,
+    WITHDRAWAL_TYPE: 0.02,
+    'Погашение облигации': 0.01,
+    'Выплата НКД': 0.01,
+}
+
+# Операции, по которым деньги приходят на счёт; остальные списывают деньги
+INFLOW_TYPES = ['Продажа ценных бумаг', COUPON_TYPE, DIVIDEND_TYPE, DEPOSIT_TYPE, 'Погашение облигации',
+                'Выплата НКД']
+TRADE_TYPES = ['Покупка ценных бумаг', 'Продажа ценных бумаг', 'Погашение облигации']
+
+INSTRUMENT_TYPES = ['share', 'bond', 'etf', 'currency']
+INSTRUMENT_TYPE_WEIGHTS = [0.5, 0.3, 0.15, 0.05]
+SECTORS = ['Нефтегазовый', 'Электроэнергетика', 'Финансовый', 'Металлургический', 'Телекоммуникаций',
+           'Химический', 'Строительный', 'Потребительский', 'Транспортный', 'ИТ', 'Другое']
+
+
+def account_names(n_accounts):
+    return np.array([f'Брокерский счёт {i + 1}' for i in range(n_accounts)], dtype=object)
+
+
+def figis(n_tickers):
+    return np.array([f'BBG{i:09d}' for i in range(n_tickers)], dtype=object)
+
+
+def generate_operations(n_rows, n_accounts=10, years=range(2020, 2025), operation_mix=None, n_tickers=200,
+                        seed=0):
+    rng = np.random.default_rng(seed)
+    years = list(years)
+    operation_mix = operation_mix or OPERATION_MIX
+    start = pd.Timestamp(year=years[0], month=1, day=1, tz='UTC')
+    end = pd.Timestamp(year=years[-1] + 1, month=1, day=1, tz='UTC')
+    seconds = rng.integers(0, int((end - start).total_seconds()), n_rows)
+    date = start + pd.to_timedelta(np.sort(seconds), unit='s')
+
+    types = list(operation_mix)
+    weights = np.array(list(operation_mix.values()))
+    accounts = account_names(n_accounts)
+    account_index = rng.integers(0, n_accounts, n_rows)
+    operation_type = np.array(types, dtype=object)[rng.choice(len(types), n_rows, p=weights / weights.sum())]
+    amount = np.round(rng.lognormal(7, 1.5, n_rows), 2)
+    is_trade = np.isin(operation_type, TRADE_TYPES)
+
+    return pd.DataFrame({
+        'id': np.arange(n_rows).astype(str),
+        'date': date,
+        'portfolio_id': (2000000000 + account_index).astype(str),
+        'portfolio_name': accounts[account_index],
+        'currency': 'rub',
+        'amount': amount,
+        'type': operation_type,
+        'payment': np.where(np.isin(operation_type, INFLOW_TYPES), amount, -amount),
+        'figi': np.where(is_trade, figis(n_tickers)[rng.integers(0, n_tickers, n_rows)], ''),
+        'quantity': np.where(is_trade, rng.integers(1, 100, n_rows), 0),
+        'year': date.year,
+        'month': date.month,
+    })
+
+
+def generate_price_history(n_tickers=200, years=range(2020, 2025), seed=0):
+    # Геометрическое случайное блуждание дневных цен закрытия, формат data/prices.csv
+    rng = np.random.default_rng(seed)
+    years = list(years)
+    dates = pd.date_range(f'{years[0]}-01-01', f'{years[-1]}-12-31', freq='D')
+    log_returns = rng.normal(0, 0.02, (len(dates), n_tickers))
+    close = np.round(rng.lognormal(5, 1, n_tickers) * np.exp(np.cumsum(log_returns, axis=0)), 4)
+    return pd.DataFrame({
+        'date': np.repeat(dates.strftime('%Y-%m-%d'), n_tickers),
+        'figi': np.tile(figis(n_tickers), len(dates)),
+        'close': close.ravel(),
+    })
+
+
+def generate_portfolio(n_accounts=10, n_tickers=200, positions_per_account=40, seed=0):
+    rng = np.random.default_rng(seed)
+    tickers = np.array([f'TCK{i:04d}' for i in range(n_tickers)], dtype=object)
+    instrument_type = rng.choice(INSTRUMENT_TYPES, n_tickers, p=INSTRUMENT_TYPE_WEIGHTS)
+    sector = np.where(instrument_type == 'share', rng.choice(SECTORS, n_tickers), 'Другое')
+    sector = np.where(instrument_type == 'etf', 'Смешанный', sector)
+    price = np.round(rng.lognormal(5, 1, n_tickers), 2)
+
+    accounts = account_names(n_accounts)
+    positions_per_account = min(positions_per_account, n_tickers)
+    rows = []
+    for account_index, account in enumerate(accounts):
+        held = rng.choice(n_tickers, positions_per_account, replace=False)
+        rows.append(pd.DataFrame({
+            'portfolio_id': str(2000000000 + account_index),
+            'portfolio_name': account,
+            'isin': [f'RU000{ticker}' for ticker in tickers[held]],
+            'ticker': tickers[held],
+            'name': [f'Инструмент {ticker}' for ticker in tickers[held]],
+            'type': instrument_type[held],
+            'sector': sector[held],
+            'currency': 'rub',
+            'quantity': rng.integers(1, 500, positions_per_account).astype(float),
+            'average_price': np.round(price[held] * rng.uniform(0.7, 1.3, positions_per_account), 2),
+            'current_price': price[held],
+        }))
+    portfolio = pd.concat(rows, ignore_index=True)
+    portfolio['expected_yield'] = np.round(
+        portfolio['quantity'] * (portfolio['current_price'] - portfolio['average_price']), 2
+    )
+    return portfolio
+
+
+def write_dataset(directory, n_rows, n_accounts=10, n_tickers=200, years=range(2020, 2025), operation_mix=None,
+                  seed=0):
+    # Файлы в том же формате, в котором их сохраняет data/api.py
+    data_directory = os.path.join(directory, 'data')
+    os.makedirs(data_directory, exist_ok=True)
+    operations = generate_operations(n_rows, n_accounts, years, operation_mix, n_tickers, seed).drop(columns=['year', 'month'])
+    operations.to_csv(os.path.join(data_directory, 'operations.csv'), index=False)
+    generate_price_history(n_tickers, years, seed).to_csv(os.path.join(data_directory, 'prices.csv'), index=False)
+    generate_portfolio(n_accounts, n_tickers, seed=seed).to_csv(os.path.join(data_directory, 'portfolio.csv'),
+                                                                index=False)
+    return data_directory
@@ -1,31 +1,89 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
 from dash import dcc, html
 import plotly.graph_objects as go
 import plotly.express as px
 
+from metrics import stage_timer
+
+FIGURE_CACHE_SIZE = 64
+# Тяжёлые графики строятся, когда их секция попадает в область видимости (assets/lazy_sections.js)
+LAZY_CHARTS = os.getenv('DASHBOARD_LAZY_CHARTS', '1') == '1'
+# Бюджет размера фигур: в treemap остаются крупнейшие позиции каждого сектора, остальные сворачиваются в «Прочие»;
+# графики по тикерам переходят на WebGL и теряют подписи точек, когда тикеров слишком много
+TREEMAP_TOP_N = int(os.getenv('DASHBOARD_TREEMAP_TOP_N', '25'))
+WEBGL_THRESHOLD = int(os.getenv('DASHBOARD_WEBGL_THRESHOLD', '500'))
+POINT_TEXT_LIMIT = int(os.getenv('DASHBOARD_POINT_TEXT_LIMIT', '40'))
+OTHER_LABEL = 'Прочие'
+_figure_cache = OrderedDict()
+_figure_cache_lock = threading.Lock()
+
+
+def frame_hash(data):
+    digest = hashlib.sha1(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+    digest.update(repr(list(data.columns)).encode())
+    return digest.hexdigest()
+
+
+def cached_figure(kind, data, build, *args):
+    # Фигуры строятся заново только при изменении агрегированных данных, старые вытесняются по LRU
+    key = (kind, frame_hash(data), args)
+    with _figure_cache_lock:
+        if key in _figure_cache:
+            _figure_cache.move_to_end(key)
+            return _figure_cache[key]
+
+    with stage_timer(f'figure_{kind}'):
+        figure = build(data, *args).to_dict()
+
+    with _figure_cache_lock:
+        _figure_cache[key] = figure
+        while len(_figure_cache) > FIGURE_CACHE_SIZE:
+            _figure_cache.popitem(last=False)
+    return figure
+
+
+def top_n_per_group(data, group, label, value, top_n=TREEMAP_TOP_N, other_label=OTHER_LABEL):
+    # Строки сверх top_n крупнейших в своей группе суммируются в одну строку other_label
+    if top_n <= 0 or data.groupby(group, observed=True).size().max() <= top_n:
+        return data
+    data = data.sort_values(value, ascending=False, kind='stable')
+    keep = data.groupby(group, observed=True).cumcount() < top_n
+    other = data[~keep].groupby(group, observed=True).sum(numeric_only=True).reset_index()
+    other[label] = other_label
+    return pd.concat([data[keep], other[data.columns]], ignore_index=True)
+
 
 def create_graph(data, asset_type):
     fig = go.Figure()
+    # На тысячах тикеров SVG-точки и подписи к каждому столбцу раздувают JSON и тормозят браузер
+    scatter = go.Scattergl if len(data) > WEBGL_THRESHOLD else go.Scatter
+    show_text = len(data) <= POINT_TEXT_LIMIT
 
-    fig.add_trace(go.Scatter(
+    fig.add_trace(scatter(
         x=data['ticker'],
         y=data['average_price'],
         name='Средняя цена',
         mode='lines+markers',
         line=dict(color='#D8D8D8', width=1, dash='dash'),
-        text=data['name'],
-        textposition='top center',
+        text=data['name'] if show_text else None,
         showlegend=False
     ))
 
-    colors = ['#396534' if curr > avg else '#C51C33' for curr, avg in zip(data['current_price'], data['average_price'])]
+    colors = np.where(data['current_price'] > data['average_price'], '#396534', '#C51C33')
     fig.add_trace(go.Bar(
         x=data['ticker'],
         y=data['current_price'],
         name='Текущая цена',
         marker_color=colors,
-        text=data['name'],
-        texttemplate='%{text}',
-        textposition='auto',
+        text=data['name'] if show_text else None,
+        texttemplate='%{text}' if show_text else None,
+        textposition='auto' if show_text else None,
         showlegend=False
     ))
 
@@ -43,10 +101,181 @@ def create_graph(data, asset_type):
     return fig
 
 
-def dashboard_layout(total_portfolio_value, total_profitability, operations_summary,
-                     total_taxes, total_commissions, payments_analytics,
-                     input_output_yearly, sunburst_data, treemap_data, grouped_data,
-                     broker_accounts, selected_account, portfolio_name=None):
+def sunburst_figure(sunburst_data):
+    return px.sunburst(
+        sunburst_data,
+        path=['type', 'portfolio_name'],
+        values='total_value',
+        title='Состав портфеля по классам активов',
+        template='plotly_dark',
+        color_discrete_sequence=["#396534", "#C51C33", "#EBC641", "#AEC76B"]
+    ).update_layout(
+        plot_bgcolor='#2A2A2A',
+        paper_bgcolor='#2A2A2A'
+    )
+
+
+def input_output_figure(input_output_yearly):
+    return px.bar(
+        input_output_yearly,
+        x='year',
+        y='amount',
+        color='account',
+        title='Пополнение и вывод средств',
+        labels={'amount': 'Сумма', 'year': 'Год'},
+        barmode='group',
+        hover_data={'type': True, 'portfolio_name': True, 'amount': ':.2f', 'account': False},
+        template='plotly_dark',
+        color_discrete_sequence=["#396534", "#C51C33", "#EBC641"]
+    ).update_layout(
+        plot_bgcolor='#2A2A2A',
+        paper_bgcolor='#2A2A2A'
+    )
+
+
+def payments_figure(payments_analytics):
+    return px.bar(
+        payments_analytics,
+        x='year',
+        y='amount',
+        color='type',
+        title='Выплаты по годам',
+        labels={'amount': 'Сумма', 'year': 'Год'},
+        barmode='group',
+        template='plotly_dark',
+        color_discrete_sequence=["#C51C33", "#396534"]
+    ).update_layout(
+        plot_bgcolor='#2A2A2A',
+        paper_bgcolor='#2A2A2A'
+    )
+
+
+def treemap_figure(treemap_data):
+    return px.treemap(
+        top_n_per_group(treemap_data, 'sector', 'name', 'total_value', TREEMAP_TOP_N),
+        path=['sector', 'name'],
+        values='total_value',
+        title='Состав портфеля по секторам',
+        template='plotly_dark',
+        color_discrete_sequence=["#396534", "#C51C33", "#EBC641", "#A20132", "#5B002B", "#A01913", "#4C1B16",
+                                 "#DE451C", "#D66626", "#66600F", "#AEC76B", "#FFFFFF", "#C0C0C0", "#516D45",
+                                 "#7C991E"]
+    ).update_layout(
+        plot_bgcolor='#2A2A2A',
+        paper_bgcolor='#2A2A2A'
+    )
+
+
+def asset_figure(grouped_data, asset_type, title):
+    return cached_figure('asset', grouped_data[grouped_data['type'] == asset_type], create_graph, title)
+
+
+def kpi_values(total_portfolio_value, total_profitability, operations_summary, total_taxes, total_commissions,
+               money_weighted_return):
+    return (
+        html.Div(f"{total_portfolio_value:,.0f}".replace(",", " ") + " ₽", style={
+            'fontSize': '32px', 'fontWeight': 'bold', 'color': '#EBC641', 'textAlign': 'center'
+        }),
+
+        html.Div(f"+{total_portfolio_value * total_profitability / 100:,.0f}".replace(",",
+                                                                                      " ") + f" ₽ ({total_profitability:+.2f}%)",
+                 style={
+                     'fontSize': '32px',
+                     'fontWeight': 'bold',
+                     'color': '#396534' if total_profitability > 0 else '#C51C33',
+                     'textAlign': 'center'
+                 }),
+
+        html.Div(
+            f"{operations_summary['total_coupons'] + operations_summary['total_dividends']:,.0f}".replace(
+                ",", " ") + " ₽", style={
+                'fontSize': '32px', 'fontWeight': 'bold', 'color': '#396534', 'textAlign': 'center'
+            }),
+
+        html.Div(f"{total_taxes + total_commissions:,.0f}".replace(",", " ") + " ₽", style={
+            'fontSize': '32px', 'fontWeight': 'bold', 'color': '#C51C33', 'textAlign': 'center'
+        }),
+
+        html.Div([
+            html.Span(
+                f"{operations_summary['total_deposits']:,.0f}".replace(",", " ") + " ₽",
+                style={
+                    'color': '#396534',
+                    'fontSize': '32px',
+                    'fontWeight': 'bold'
+                }
+            ),
+            html.Span(
+                f" / {operations_summary['total_withdrawals']:,.0f}".replace(",", " ") + " ₽",
+                style={
+                    'color': '#C51C33',
+                    'fontSize': '32px',
+                    'fontWeight': 'bold'
+                }
+            ),
+        ], style={
+            'textAlign': 'center'
+        }),
+
+        html.Div(f"{money_weighted_return:+.2%}" if money_weighted_return == money_weighted_return else "—", style={
+            'fontSize': '32px',
+            'fontWeight': 'bold',
+            'color': ('#D8D8D8' if money_weighted_return != money_weighted_return
+                      else '#C51C33' if money_weighted_return < 0 else '#396534'),
+            'textAlign': 'center'
+        }),
+    )
+
+
+def kpi_block(kpi_id, label):
+    return html.Div([
+        html.Div(id=kpi_id),
+        html.Div(label, style={
+            'fontSize': '18px', 'fontWeight': 'bold', 'color': '#D8D8D8', 'textAlign': 'center'
+        })
+    ], style={'flex': 1, 'padding': '20px'})
+
+
+# Идентификаторы KPI в том же порядке, в котором их возвращает kpi_values
+KPI_IDS = ['kpi-portfolio-value', 'kpi-profitability', 'kpi-payments', 'kpi-taxes', 'kpi-input-output', 'kpi-mwr']
+
+
+def section_visible_id(section):
+    return f'{section}-visible'
+
+
+def lazy_section(section, children, style):
+    # Флаг видимости секции выставляет браузер; без ленивой загрузки он сразу True
+    return html.Div(
+        [dcc.Store(id=section_visible_id(section), data=not LAZY_CHARTS)] + children,
+        id=f'{section}-section', className='lazy-section', **{'data-section': section}, style=style
+    )
+
+
+def loading_layout():
+    return html.Div("Загрузка данных...", style={
+        'color': '#D8D8D8', 'fontSize': '24px', 'textAlign': 'center', 'padding': '100px'
+    })
+
+
+def date_range_slider(month_bounds):
+    # Диапазон задаётся сквозными номерами месяцев (год * 12 + месяц - 1), подписи — по январям
+    start, end = month_bounds if month_bounds else (0, 0)
+    return dcc.RangeSlider(
+        id='date-range',
+        min=start,
+        max=end,
+        step=1,
+        value=[start, end],
+        marks={number: str(number // 12) for number in range(start + (-start) % 12, end + 1, 12)},
+        allowCross=False,
+        updatemode='mouseup',
+        disabled=month_bounds is None
+    )
+
+
+def dashboard_layout(broker_accounts, selected_account, portfolio_name=None, month_bounds=None):
+    # Статический каркас страницы: KPI и графики заполняются отдельными callback по своим id
     return html.Div([
         html.Div([
             # Контейнер для заголовка и выпадающего списка
@@ -79,7 +308,8 @@ def dashboard_layout(total_portfolio_value, total_profitability, operations_summ
                             'backgroundColor': '#2A2A2A',
                         },
 
-                    )
+                    ),
+                    date_range_slider(month_bounds)
                 ], style={'flex': 0, 'paddingRight': '20px'})
 
             ], style={
@@ -97,75 +327,12 @@ def dashboard_layout(total_portfolio_value, total_profitability, operations_summ
         html.Div([
 
             html.Div([
-                html.Div([
-                    html.Div(f"{total_portfolio_value:,.0f}".replace(",", " ") + " ₽", style={
-                        'fontSize': '32px', 'fontWeight': 'bold', 'color': '#EBC641', 'textAlign': 'center'
-                    }),
-                    html.Div("Стоимость портфеля", style={
-                        'fontSize': '18px', 'fontWeight': 'bold', 'color': '#D8D8D8', 'textAlign': 'center'
-                    })
-                ], style={'flex': 1, 'padding': '20px'}),
-
-                html.Div([
-                    html.Div(f"+{total_portfolio_value * total_profitability / 100:,.0f}".replace(",",
-                                                                                                  " ") + f" ₽ ({total_profitability:+.2f}%)",
-                             style={
-                                 'fontSize': '32px',
-                                 'fontWeight': 'bold',
-                                 'color': '#396534' if total_profitability > 0 else '#C51C33',
-                                 'textAlign': 'center'
-                             }),
-                    html.Div("Доходность", style={
-                        'fontSize': '18px', 'fontWeight': 'bold', 'color': '#D8D8D8', 'textAlign': 'center'
-                    })
-                ], style={'flex': 1, 'padding': '20px'}),
-
-                html.Div([
-                    html.Div(
-                        f"{operations_summary['total_coupons'] + operations_summary['total_dividends']:,.0f}".replace(
-                            ",", " ") + " ₽", style={
-                            'fontSize': '32px', 'fontWeight': 'bold', 'color': '#396534', 'textAlign': 'center'
-                        }),
-                    html.Div("Купоны и дивиденды", style={
-                        'fontSize': '18px', 'fontWeight': 'bold', 'color': '#D8D8D8', 'textAlign': 'center'
-                    })
-                ], style={'flex': 1, 'padding': '20px'}),
-
-                html.Div([
-                    html.Div(f"{total_taxes + total_commissions:,.0f}".replace(",", " ") + " ₽", style={
-                        'fontSize': '32px', 'fontWeight': 'bold', 'color': '#C51C33', 'textAlign': 'center'
-                    }),
-                    html.Div("Налоги и комиссии", style={
-                        'fontSize': '18px', 'fontWeight': 'bold', 'color': '#D8D8D8', 'textAlign': 'center'
-                    })
-                ], style={'flex': 1, 'padding': '20px'}),
-
-                html.Div([
-                    html.Div([
-                        html.Span(
-                            f"{operations_summary['total_deposits']:,.0f}".replace(",", " ") + " ₽",
-                            style={
-                                'color': '#396534',
-                                'fontSize': '32px',
-                                'fontWeight': 'bold'
-                            }
-                        ),
-                        html.Span(
-                            f" / {operations_summary['total_withdrawals']:,.0f}".replace(",", " ") + " ₽",
-                            style={
-                                'color': '#C51C33',
-                                'fontSize': '32px',
-                                'fontWeight': 'bold'
-                            }
-                        ),
-                    ], style={
-                        'textAlign': 'center'
-                    }),
-                    html.Div("Пополнение / Вывод", style={
-                        'fontSize': '18px', 'fontWeight': 'bold', 'color': '#D8D8D8', 'textAlign': 'center'
-                    })
-                ], style={'flex': 1, 'padding': '20px'}),
-
+                kpi_block(KPI_IDS[0], "Стоимость портфеля"),
+                kpi_block(KPI_IDS[1], "Доходность"),
+                kpi_block(KPI_IDS[5], "Доходность (XIRR)"),
+                kpi_block(KPI_IDS[2], "Купоны и дивиденды"),
+                kpi_block(KPI_IDS[3], "Налоги и комиссии"),
+                kpi_block(KPI_IDS[4], "Пополнение / Вывод"),
             ], style={
                 'display': 'flex',
                 'justifyContent': 'space-around',
@@ -178,20 +345,10 @@ def dashboard_layout(total_portfolio_value, total_profitability, operations_summ
             })
         ]),
 
-        html.Div([
+        lazy_section('overview', [
             html.Div([
                 dcc.Graph(
-                    figure=px.sunburst(
-                        sunburst_data,
-                        path=['type', 'portfolio_name'],
-                        values='total_value',
-                        title='Состав портфеля по классам активов',
-                        template='plotly_dark',
-                        color_discrete_sequence=["#396534", "#C51C33", "#EBC641", "#AEC76B"]
-                    ).update_layout(
-                        plot_bgcolor='#2A2A2A',
-                        paper_bgcolor='#2A2A2A'
-                    ),
+                    id='sunburst-graph',
                     style={
                         'padding': '20px',
                         'margin': '10px',
@@ -210,21 +367,7 @@ def dashboard_layout(total_portfolio_value, total_profitability, operations_summ
 
             html.Div([
                 dcc.Graph(
-                    figure=px.bar(
-                        input_output_yearly,
-                        x='year',
-                        y='amount',
-                        color='account',
-                        title='Пополнение и вывод средств',
-                        labels={'amount': 'Сумма', 'year': 'Год'},
-                        barmode='group',
-                        hover_data={'type': True, 'portfolio_name': True, 'amount': ':.2f', 'account': False},
-                        template='plotly_dark',
-                        color_discrete_sequence=["#396534", "#C51C33", "#EBC641"]
-                    ).update_layout(
-                        plot_bgcolor='#2A2A2A',
-                        paper_bgcolor='#2A2A2A'
-                    ),
+                    id='input-output-graph',
                     style={
                         'padding': '20px',
                         'marginBottom': '20px',
@@ -232,20 +375,7 @@ def dashboard_layout(total_portfolio_value, total_profitability, operations_summ
                     }
                 ),
                 dcc.Graph(
-                    figure=px.bar(
-                        payments_analytics,
-                        x='year',
-                        y='amount',
-                        color='type',
-                        title='Выплаты по годам',
-                        labels={'amount': 'Сумма', 'year': 'Год'},
-                        barmode='group',
-                        template='plotly_dark',
-                        color_discrete_sequence=["#C51C33", "#396534"]
-                    ).update_layout(
-                        plot_bgcolor='#2A2A2A',
-                        paper_bgcolor='#2A2A2A'
-                    ),
+                    id='payments-graph',
                     style={
                         'padding': '20px',
                         'height': '390px'
@@ -262,37 +392,27 @@ def dashboard_layout(total_portfolio_value, total_profitability, operations_summ
             })
         ], style={'display': 'flex', 'justifyContent': 'space-between', 'marginBottom': '20px'}),
 
-        dcc.Graph(
-            figure=px.treemap(
-                treemap_data,
-                path=['sector', 'name'],
-                values='total_value',
-                title='Состав портфеля по секторам',
-                template='plotly_dark',
-                color_discrete_sequence=["#396534", "#C51C33", "#EBC641", "#A20132", "#5B002B", "#A01913", "#4C1B16",
-                                         "#DE451C", "#D66626", "#66600F", "#AEC76B", "#FFFFFF", "#C0C0C0", "#516D45",
-                                         "#7C991E"]
-            ).update_layout(
-                plot_bgcolor='#2A2A2A',
-                paper_bgcolor='#2A2A2A'
-            ),
-            style={'backgroundColor': '#2A2A2A', 'height': '800px', 'padding': '20px', 'marginTop': '20px',
-                   'borderRadius': '10px',
-                   'boxShadow': '0px 4px 10px rgba(0, 0, 0, 0.5)'}
-        ),
+        lazy_section('treemap', [
+            dcc.Graph(
+                id='treemap-graph',
+                style={'backgroundColor': '#2A2A2A', 'height': '800px', 'padding': '20px', 'marginTop': '20px',
+                       'borderRadius': '10px',
+                       'boxShadow': '0px 4px 10px rgba(0, 0, 0, 0.5)'}
+            )
+        ], style={'minHeight': '840px'}),
 
-        html.Div([
+        lazy_section('assets', [
             html.Div([
                 dcc.Graph(
-                    figure=create_graph(grouped_data[grouped_data['type'] == 'share'], 'акций'),
+                    id='share-graph',
                     style={'flexBasis': '30%'}
                 ),
                 dcc.Graph(
-                    figure=create_graph(grouped_data[grouped_data['type'] == 'bond'], 'облигаций'),
+                    id='bond-graph',
                     style={'flexBasis': '30%'}
                 ),
                 dcc.Graph(
-                    figure=create_graph(grouped_data[grouped_data['type'] == 'etf'], 'ETF'),
+                    id='etf-graph',
                     style={'flexBasis': '30%'}
                 )
             ], style={
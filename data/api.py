@@ -1,134 +1,202 @@
+import argparse
 import asyncio
 import pandas as pd
 from tinkoff.invest import AsyncClient, InstrumentIdType
 import os
 from dotenv import load_dotenv
+from instrument_cache import InstrumentCache, DEFAULT_TTL
+from rate_limiter import RateLimiter
+from sector_index import SectorIndex
+from operations_sync import (read_json, write_json_atomic, has_operation_ids, sync_start, account_sync_state,
+                             update_sync_state, write_csv_atomic, write_merged_operations)
+from fetch_run import FetchRun
 
 load_dotenv()
 TOKEN = os.getenv('API_TOKEN')
-instrument_cache = {}
-
-def get_manual_sector(ticker, instrument_type, instrument_name):
-    if instrument_type == 'etf':
-        return 'Смешанный'
-    elif instrument_type == 'bond' and 'ОФЗ' in instrument_name:
-        return 'Государственный'
-    elif instrument_type == 'share':
-        sectors = {
-            'Нефтегазовый': ['LKOH', 'ROSN', 'NVTK', 'GAZP', 'SIBN', 'SNGSP', 'TATNP'],
-            'Электроэнергетика': ['FEES', 'UPRO', 'HYDR'],
-            'Финансовый': ['MOEX', 'SBER', 'SBERP', 'T', 'VTBR'],
-            'Металлургический': ['CHMF', 'TRMK', 'ALRS', 'MAGN', 'NLMK'],
-            'Телекоммуникаций': ['MTSS', 'RTKM', 'RTKMP'],
-            'Химический': ['PHOR', 'NKNC', 'NKNCP'],
-            'Золотодобытчиков': ['PLZL'],
-            'Строительный': ['PIKK', 'ETLN'],
-            'Потребительский': ['MGNT', 'MVID', 'LSRG', 'OZON'],
-            'Транспортный': ['FLOT', 'NMTP', 'FIVE', 'AGRO'],
-            'Здравоохранения': ['MDMG'],
-            'ИТ': ['YDEX']
-        }
-        for sector, tickers in sectors.items():
-            if ticker in tickers:
-                return sector
-    return 'Другое'
-
+# Максимум одновременных запросов к API, чтобы не упираться в лимиты
+MAX_CONCURRENT_REQUESTS = int(os.getenv('API_MAX_CONCURRENT_REQUESTS', 5))
+# Средняя скорость и допустимый всплеск запросов для token bucket
+API_REQUESTS_PER_SECOND = float(os.getenv('API_REQUESTS_PER_SECOND', 3))
+API_BURST = int(os.getenv('API_BURST', 10))
+EXCLUDED_ACCOUNT_IDS = {'2095107625'}
+INSTRUMENT_CACHE_PATH = os.getenv('INSTRUMENT_CACHE_PATH', 'instruments.sqlite')
+INSTRUMENT_CACHE_TTL = int(os.getenv('INSTRUMENT_CACHE_TTL', DEFAULT_TTL))
+SYNC_STATE_PATH = os.getenv('SYNC_STATE_PATH', 'sync_state.json')
 
 def calculate_amount(units, nano):
     return units + nano / 1_000_000_000
 
 
-async def get_instrument_info_safe(client, figi, retries=3, delay=5):
-    if figi in instrument_cache:
-        return instrument_cache[figi]
-    for attempt in range(retries):
-        try:
-            instrument_info = await client.instruments.get_instrument_by(
-                id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_FIGI,
-                id=figi
-            )
-            instrument_cache[figi] = instrument_info
-            return instrument_info
-        except Exception as e:
-            if "RESOURCE_EXHAUSTED" in str(e):
-                print(f"Лимит запросов исчерпан, попытка {attempt + 1}/{retries}, ждем {delay} секунд")
-                await asyncio.sleep(delay)
-            else:
-                raise e
-    raise RuntimeError(f"Не удалось получить данные для FIGI {figi} после {retries} попыток")
-
-
-async def main():
+async def get_instrument_info_safe(client, figi, limiter, instrument_cache):
+    cached = instrument_cache.get(figi)
+    if cached is not None:
+        return cached
+    instrument_info = await limiter.call(
+        client.instruments.get_instrument_by,
+        id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_FIGI,
+        id=figi
+    )
+    instrument = instrument_info.instrument
+    instrument = {
+        'ticker': instrument.ticker if instrument else None,
+        'isin': instrument.isin if instrument else "Другое",
+        'name': instrument.name if instrument else "Другое",
+    }
+    instrument_cache.put(figi, instrument)
+    return instrument
+
+
+async def fetch_operations(client, account, limiter, since=None):
+    if since is None:
+        operations = await limiter.call(client.operations.get_operations, account_id=account.id)
+    else:
+        operations = await limiter.call(client.operations.get_operations, account_id=account.id, from_=since)
+    return [{
+        'id': operation.id,
+        'date': operation.date,
+        'portfolio_id': account.id,
+        'portfolio_name': account.name,
+        'currency': operation.payment.currency,
+        'amount': abs(calculate_amount(operation.payment.units, operation.payment.nano)),
+        'type': operation.type,
+        # Для восстановления позиций и денежного остатка по дням
+        'payment': calculate_amount(operation.payment.units, operation.payment.nano),
+        'figi': operation.figi,
+        'quantity': operation.quantity,
+    } for operation in operations.operations]
+
+
+async def fetch_positions(client, account, limiter):
+    portfolio = await limiter.call(client.operations.get_portfolio, account_id=account.id)
+    positions = []
+    for position in portfolio.positions:
+        if not position.figi:
+            print(f"Пропущена позиция без FIGI: {position}")
+            continue
+
+        positions.append({
+            'figi': position.figi,
+            'portfolio_id': account.id,
+            'portfolio_name': account.name,
+            'type': position.instrument_type,
+            'currency': position.current_price.currency,
+            'quantity': calculate_amount(position.quantity.units, position.quantity.nano),
+            'average_price': calculate_amount(position.average_position_price.units,
+                                              position.average_position_price.nano),
+            'current_price': calculate_amount(position.current_price.units, position.current_price.nano),
+            'expected_yield': calculate_amount(position.expected_yield.units, position.expected_yield.nano),
+        })
+    return positions
+
+
+async def fetch_account(client, account, limiter, since=None):
+    print(f"Название счета: {account.name}" + (f", операции с {since:%Y-%m-%d %H:%M}" if since else ""))
+    return await asyncio.gather(
+        fetch_operations(client, account, limiter, since),
+        fetch_positions(client, account, limiter)
+    )
+
+
+async def fetch_and_store_account(client, account, limiter, since, run):
+    # Операции и позиции счёта сразу уходят на диск, в памяти не копится вся история по всем счетам
+    operations, positions = await fetch_account(client, account, limiter, since)
+    run.write_account(account.id, operations, positions, account_sync_state(operations))
+
+
+async def fetch_instruments(client, figis, limiter, instrument_cache):
+    figis = list(figis)
+    instrument_cache.warm_up(figis)
+    results = await asyncio.gather(
+        *(get_instrument_info_safe(client, figi, limiter, instrument_cache) for figi in figis),
+        return_exceptions=True
+    )
+    instruments = {}
+    for figi, result in zip(figis, results):
+        if isinstance(result, Exception):
+            print(f"Ошибка при получении информации об инструменте {figi}: {result}")
+            continue
+        instruments[figi] = result
+    return instruments
+
+
+def build_portfolio_row(position, instrument):
+    return {
+        'portfolio_id': position['portfolio_id'],
+        'portfolio_name': position['portfolio_name'],
+        'isin': instrument['isin'],
+        'ticker': instrument['ticker'],
+        'name': instrument['name'],
+        'type': position['type'],
+        'currency': position['currency'],
+        'quantity': position['quantity'],
+        'average_price': position['average_price'],
+        'current_price': position['current_price'],
+        'expected_yield': position['expected_yield'],
+    }
+
+
+async def main(max_concurrent_requests=MAX_CONCURRENT_REQUESTS, full_resync=False):
+    limiter = RateLimiter(rate=API_REQUESTS_PER_SECOND, capacity=API_BURST, max_concurrent=max_concurrent_requests)
+    instrument_cache = InstrumentCache(INSTRUMENT_CACHE_PATH, ttl=INSTRUMENT_CACHE_TTL)
+    try:
+        await fetch_all(limiter, instrument_cache, full_resync)
+    finally:
+        print(limiter.report())
+        print(instrument_cache.report())
+        instrument_cache.close()
+
+
+async def fetch_all(limiter, instrument_cache, full_resync=False):
+    incremental = not full_resync and has_operation_ids('operations.csv')
+    sync_state = read_json(SYNC_STATE_PATH, {}) if incremental else {}
+    run = FetchRun(full_resync=not incremental)
+
     async with AsyncClient(TOKEN) as client:
-        accounts = await client.users.get_accounts()
-        operations_data = []
-        portfolio_data = []
-
-        for account in accounts.accounts:
-            if account.id != '2095107625':
-                print(f"Название счета: {account.name}")
-
-                operations = await client.operations.get_operations(account_id=account.id)
-                for operation in operations.operations:
-                    operations_data.append({
-                        'date': operation.date,
-                        'portfolio_id': account.id,
-                        'portfolio_name': account.name,
-                        'currency': operation.payment.currency,
-                        'amount': abs(calculate_amount(operation.payment.units, operation.payment.nano)),
-                        'type': operation.type,
-                    })
-
-                portfolio = await client.operations.get_portfolio(account_id=account.id)
-                for position in portfolio.positions:
-                    figi = position.figi
-                    if not figi:
-                        print(f"Пропущена позиция без FIGI: {position}")
-                        continue
-
-                    instrument_type = position.instrument_type
-                    quantity = calculate_amount(position.quantity.units, position.quantity.nano)
-                    average_price = calculate_amount(position.average_position_price.units,
-                                                     position.average_position_price.nano)
-                    current_price = calculate_amount(position.current_price.units, position.current_price.nano)
-                    expected_yield = calculate_amount(position.expected_yield.units, position.expected_yield.nano)
-
-                    try:
-                        instrument_info = await get_instrument_info_safe(client, figi)
-                    except Exception as e:
-                        print(f"Ошибка при получении информации об инструменте {figi}: {e}")
-                        continue
-
-                    ticker = instrument_info.instrument.ticker if instrument_info.instrument else None
-                    isin = instrument_info.instrument.isin if instrument_info.instrument else "Другое"
-                    instrument_name = instrument_info.instrument.name if instrument_info.instrument else "Другое"
-
-                    sector = get_manual_sector(ticker, instrument_type, instrument_name)
-
-                    portfolio_data.append({
-                        'portfolio_id': account.id,
-                        'portfolio_name': account.name,
-                        'isin': isin,
-                        'ticker': ticker,
-                        'name': instrument_name,
-                        'type': instrument_type,
-                        'sector': sector,
-                        'quantity': quantity,
-                        'average_price': average_price,
-                        'current_price': current_price,
-                        'expected_yield': expected_yield,
-                    })
-
-        portfolio_df = pd.DataFrame(portfolio_data)
-        operations_df = pd.DataFrame(operations_data)
-
-        pd.set_option('display.max_columns', None)
-        pd.set_option('display.max_rows', None)
-        pd.set_option('display.max_colwidth', None)
-
-        portfolio_df.to_csv('portfolio.csv', index=False)
-        operations_df.to_csv('operations.csv', index=False)
+        accounts = await limiter.call(client.users.get_accounts)
+        accounts = [account for account in accounts.accounts if account.id not in EXCLUDED_ACCOUNT_IDS]
+        pending = [account for account in accounts if not run.is_done(account.id)]
+        if run.resumed:
+            print(f"Продолжение прерванной выгрузки: готово {len(accounts) - len(pending)} из {len(accounts)} счетов")
+
+        # Счета, а внутри них операции и портфель, запрашиваются параллельно.
+        # Ошибка одного счёта не отменяет остальные: готовые сохраняются, повторный запуск догрузит упавшие
+        results = await asyncio.gather(*(
+            fetch_and_store_account(client, account, limiter, sync_start(sync_state, account.id), run)
+            for account in pending
+        ), return_exceptions=True)
+        failed = [(account, result) for account, result in zip(pending, results) if isinstance(result, Exception)]
+        for account, error in failed:
+            print(f"Ошибка выгрузки счёта {account.name}: {error}")
+        if failed:
+            raise RuntimeError(f"Не выгружено счетов: {len(failed)}, запустите выгрузку ещё раз")
+
+        positions = run.positions()
+        # Каждый FIGI запрашивается один раз, даже если он есть на нескольких счетах
+        instruments = await fetch_instruments(
+            client, {position['figi'] for position in positions}, limiter, instrument_cache
+        )
+        portfolio_data = [
+            build_portfolio_row(position, instruments[position['figi']])
+            for position in positions if position['figi'] in instruments
+        ]
+
+    portfolio_df = pd.DataFrame(portfolio_data)
+    # Сектора всех позиций проставляются одним проходом по справочнику
+    if not portfolio_df.empty:
+        sector_index = SectorIndex.from_files()
+        sectors = sector_index.classify_frame(portfolio_df)
+        portfolio_df.insert(portfolio_df.columns.get_loc('type') + 1, 'sector', sectors)
+        print(sector_index.report(portfolio_df, sectors))
+
+    # Итоговые файлы подменяются целиком; до этого момента прерванный запуск можно продолжить
+    write_csv_atomic(portfolio_df, 'portfolio.csv')
+    write_merged_operations('operations.csv' if incremental else None, run.operation_parts(), 'operations.csv')
+    write_json_atomic(SYNC_STATE_PATH, update_sync_state(sync_state, run.account_states()))
+    run.finish()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description='Выгрузка операций и портфеля по брокерским счетам')
+    parser.add_argument('--full', action='store_true', help='загрузить всю историю операций заново')
+    args = parser.parse_args()
+    asyncio.run(main(full_resync=args.full))
@@ -0,0 +1,59 @@
+import os
+import shutil
+
+import pandas as pd
+
+from operations_sync import read_json, write_json_atomic, write_csv_atomic, OPERATIONS_CSV_DTYPES
+
+# Каталог текущего запуска выгрузки: части по счетам и манифест готовых счетов.
+# Если запуск прервался, следующий продолжает с тех счетов, которых нет в манифесте
+FETCH_RUN_DIR = os.getenv('FETCH_RUN_DIR', '.fetch_run')
+
+
+class FetchRun:
+    def __init__(self, directory=FETCH_RUN_DIR, full_resync=False):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, 'manifest.json')
+        manifest = read_json(self.manifest_path)
+        if manifest is None or manifest.get('full_resync') != full_resync:
+            shutil.rmtree(directory, ignore_errors=True)
+            manifest = {'full_resync': full_resync, 'completed': {}}
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = manifest
+
+    def _part_path(self, kind, account_id):
+        return os.path.join(self.directory, f'{kind}-{account_id}.csv')
+
+    @property
+    def resumed(self):
+        return bool(self.manifest['completed'])
+
+    def is_done(self, account_id):
+        return account_id in self.manifest['completed']
+
+    def write_account(self, account_id, operations, positions, sync_state):
+        # Сначала части счёта, потом запись в манифесте: счёт считается готовым, только если обе части на диске
+        for kind, rows in (('operations', operations), ('positions', positions)):
+            if rows:
+                write_csv_atomic(pd.DataFrame(rows), self._part_path(kind, account_id))
+        self.manifest['completed'][account_id] = sync_state
+        write_json_atomic(self.manifest_path, self.manifest)
+
+    def _existing_parts(self, kind):
+        paths = (self._part_path(kind, account_id) for account_id in self.manifest['completed'])
+        return [path for path in paths if os.path.exists(path)]
+
+    def operation_parts(self):
+        return self._existing_parts('operations')
+
+    def positions(self):
+        parts = [pd.read_csv(path, dtype=OPERATIONS_CSV_DTYPES) for path in self._existing_parts('positions')]
+        if not parts:
+            return []
+        return pd.concat(parts, ignore_index=True).to_dict('records')
+
+    def account_states(self):
+        return self.manifest['completed']
+
+    def finish(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
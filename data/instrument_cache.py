@@ -0,0 +1,90 @@
+import sqlite3
+import time
+
+# Тикер, ISIN и название инструмента почти не меняются, поэтому хранятся между запусками
+DEFAULT_TTL = 30 * 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 10_000
+
+
+class InstrumentCache:
+    def __init__(self, path='instruments.sqlite', ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._accessed = {}
+        self._connection = sqlite3.connect(path)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS instruments ('
+            'figi TEXT PRIMARY KEY, ticker TEXT, isin TEXT, name TEXT, '
+            'fetched_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+        )
+        self._connection.execute('CREATE INDEX IF NOT EXISTS instruments_accessed_at ON instruments (accessed_at)')
+
+    def _is_expired(self, fetched_at, now):
+        return now - fetched_at > self.ttl
+
+    def warm_up(self, figis=None):
+        # Одним запросом поднимает в память все известные инструменты, возвращает FIGI, которых нет в кэше
+        now = time.time()
+        if figis is None:
+            rows = self._connection.execute('SELECT figi, ticker, isin, name, fetched_at FROM instruments').fetchall()
+        else:
+            figis = list(figis)
+            rows = []
+            for start in range(0, len(figis), 500):
+                chunk = figis[start:start + 500]
+                rows += self._connection.execute(
+                    f"SELECT figi, ticker, isin, name, fetched_at FROM instruments "
+                    f"WHERE figi IN ({', '.join('?' * len(chunk))})", chunk
+                ).fetchall()
+
+        for figi, ticker, isin, name, fetched_at in rows:
+            if not self._is_expired(fetched_at, now):
+                self._entries[figi] = {'ticker': ticker, 'isin': isin, 'name': name}
+
+        if figis is None:
+            return set()
+        return {figi for figi in figis if figi not in self._entries}
+
+    def get(self, figi):
+        if figi not in self._entries:
+            row = self._connection.execute(
+                'SELECT ticker, isin, name, fetched_at FROM instruments WHERE figi = ?', (figi,)
+            ).fetchone()
+            if row is None or self._is_expired(row[3], time.time()):
+                self.misses += 1
+                return None
+            self._entries[figi] = {'ticker': row[0], 'isin': row[1], 'name': row[2]}
+
+        self.hits += 1
+        self._accessed[figi] = time.time()
+        return self._entries[figi]
+
+    def put(self, figi, instrument):
+        now = time.time()
+        self._entries[figi] = instrument
+        self._connection.execute(
+            'INSERT OR REPLACE INTO instruments (figi, ticker, isin, name, fetched_at, accessed_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (figi, instrument['ticker'], instrument['isin'], instrument['name'], now, now)
+        )
+
+    def close(self):
+        self._connection.executemany(
+            'UPDATE instruments SET accessed_at = ? WHERE figi = ?',
+            [(accessed_at, figi) for figi, accessed_at in self._accessed.items()]
+        )
+        # Ограничение размера: удаляются давно не использованные записи
+        self._connection.execute(
+            'DELETE FROM instruments WHERE figi NOT IN '
+            '(SELECT figi FROM instruments ORDER BY accessed_at DESC LIMIT ?)', (self.max_entries,)
+        )
+        self._connection.commit()
+        self._connection.close()
+
+    def report(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total * 100 if total else 0
+        return f"Кэш инструментов: попаданий {self.hits}, промахов {self.misses} ({hit_rate:.0f}% попаданий)"
@@ -0,0 +1,123 @@
+import json
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# Для каждого счёта хранится отметка последней загруженной операции (high-water mark)
+OPERATIONS_CSV_DTYPES = {'id': str, 'portfolio_id': str}
+
+
+def tmp_path(path):
+    # Выгрузку могут одновременно запустить фоновый поток дашборда и пользователь вручную:
+    # у каждого процесса и потока свой временный файл
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def read_json(path, default=None):
+    try:
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json_atomic(path, value):
+    tmp = tmp_path(path)
+    with open(tmp, 'w', encoding='utf-8') as file:
+        json.dump(value, file, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def write_csv_atomic(df, path, **kwargs):
+    # Файл появляется под своим именем только целиком: запись во временный файл и rename
+    tmp = tmp_path(path)
+    df.to_csv(tmp, index=False, **kwargs)
+    os.replace(tmp, path)
+
+
+def has_operation_ids(path):
+    # Файлы старого формата без id операций нельзя дополнять, нужна полная загрузка
+    if not os.path.exists(path):
+        return False
+    return 'id' in pd.read_csv(path, nrows=0).columns
+
+
+def sync_start(state, account_id):
+    account_state = state.get(account_id)
+    if not account_state:
+        return None
+    return datetime.fromisoformat(account_state['last_date'])
+
+
+def read_operation_part(path):
+    # Часть одного счёта: ключ (portfolio_id, id) уникален в пределах счёта, поэтому повторы ищутся только внутри части
+    return pd.read_csv(path, dtype=OPERATIONS_CSV_DTYPES).drop_duplicates(['portfolio_id', 'id'], keep='last')
+
+
+def part_operation_ids(part_paths):
+    # id новых операций по счетам; из частей читаются только ключевые колонки
+    ids = {}
+    for path in part_paths:
+        keys = pd.read_csv(path, usecols=['portfolio_id', 'id'], dtype=OPERATIONS_CSV_DTYPES)
+        for account_id, account_ids in keys.groupby('portfolio_id')['id']:
+            known = ids.get(account_id)
+            account_ids = pd.Index(account_ids.to_numpy())
+            ids[account_id] = account_ids if known is None else known.append(account_ids)
+    return ids
+
+
+def csv_columns(path):
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def write_merged_operations(stored_path, part_paths, output_path, chunksize=500_000):
+    # И сохранённая история, и части счетов переписываются по одной, в памяти не бывает всей истории сразу.
+    # Интервал загрузки начинается с последней известной операции, поэтому она приходит повторно и заменяет старую
+    has_stored = stored_path is not None and os.path.exists(stored_path)
+    if part_paths:
+        columns = csv_columns(part_paths[0])
+    else:
+        columns = csv_columns(stored_path) if has_stored else []
+    tmp = tmp_path(output_path)
+    header = True
+
+    def append(frame):
+        nonlocal header
+        frame.reindex(columns=columns).to_csv(tmp, mode='w' if header else 'a', header=header, index=False)
+        header = False
+
+    if has_stored:
+        new_ids = part_operation_ids(part_paths)
+        for chunk in pd.read_csv(stored_path, dtype=OPERATIONS_CSV_DTYPES, chunksize=chunksize):
+            replaced = np.zeros(len(chunk), dtype=bool)
+            for account_id, account_ids in new_ids.items():
+                rows = (chunk['portfolio_id'] == account_id).to_numpy()
+                if rows.any():
+                    replaced[rows] = chunk['id'][rows].isin(account_ids).to_numpy()
+            append(chunk[~replaced])
+    for path in part_paths:
+        append(read_operation_part(path))
+    if header:
+        append(pd.DataFrame(columns=columns))
+    os.replace(tmp, output_path)
+
+
+def account_sync_state(operations):
+    if not operations:
+        return None
+    last = max(operations, key=lambda row: row['date'])
+    return {'last_date': last['date'].isoformat(), 'last_id': last['id']}
+
+
+def update_sync_state(state, account_states):
+    for account_id, account_state in account_states.items():
+        if account_state is None:
+            continue
+        current = state.get(account_id)
+        if current is None or (datetime.fromisoformat(current['last_date']) <
+                               datetime.fromisoformat(account_state['last_date'])):
+            state[account_id] = account_state
+    return state
@@ -0,0 +1,80 @@
+import argparse
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+from tinkoff.invest import AsyncClient, CandleInterval
+
+from api import TOKEN, MAX_CONCURRENT_REQUESTS, API_REQUESTS_PER_SECOND, API_BURST, calculate_amount
+from operations_sync import write_csv_atomic
+from rate_limiter import RateLimiter
+
+# Файл цен закрытия для valuation.py: date, figi, close
+PRICES_PATH = 'prices.csv'
+# Дневные свечи API отдаёт интервалами не длиннее года
+CANDLES_SPAN = timedelta(days=365)
+
+
+def price_ranges(operations_path, prices_path, now):
+    # Для каждого FIGI из операций: с первой операции или с последней сохранённой цены до текущего момента
+    operations = pd.read_csv(operations_path, usecols=['date', 'figi'], dtype={'figi': str})
+    operations = operations[operations['figi'].notna() & (operations['figi'] != '')]
+    starts = pd.to_datetime(operations['date'], utc=True, format='ISO8601').groupby(operations['figi']).min()
+    if os.path.exists(prices_path):
+        stored = pd.read_csv(prices_path)
+        last = pd.to_datetime(stored['date'], utc=True).groupby(stored['figi']).max()
+        starts.update(last.reindex(starts.index).dropna())
+    return {figi: start.to_pydatetime() for figi, start in starts.items() if start < now}
+
+
+async def fetch_candles(client, figi, start, end, limiter):
+    rows = []
+    while start < end:
+        chunk_end = min(start + CANDLES_SPAN, end)
+        candles = await limiter.call(client.market_data.get_candles, figi=figi, from_=start, to=chunk_end,
+                                     interval=CandleInterval.CANDLE_INTERVAL_DAY)
+        rows.extend({
+            'date': candle.time.strftime('%Y-%m-%d'),
+            'figi': figi,
+            'close': calculate_amount(candle.close.units, candle.close.nano),
+        } for candle in candles.candles)
+        start = chunk_end
+    return rows
+
+
+async def fetch_prices(limiter, operations_path='operations.csv', prices_path=PRICES_PATH):
+    now = datetime.now(timezone.utc)
+    ranges = price_ranges(operations_path, prices_path, now)
+    async with AsyncClient(TOKEN) as client:
+        results = await asyncio.gather(
+            *(fetch_candles(client, figi, start, now, limiter) for figi, start in ranges.items()),
+            return_exceptions=True
+        )
+    rows = []
+    for figi, result in zip(ranges, results):
+        if isinstance(result, Exception):
+            print(f"Ошибка при получении цен {figi}: {result}")
+            continue
+        rows.extend(result)
+
+    prices = pd.DataFrame(rows, columns=['date', 'figi', 'close'])
+    if os.path.exists(prices_path):
+        prices = pd.concat([pd.read_csv(prices_path), prices], ignore_index=True)
+    # Незакрытая дневная свеча приходит повторно и заменяет сохранённую
+    prices = prices.drop_duplicates(['date', 'figi'], keep='last').sort_values(['figi', 'date'])
+    write_csv_atomic(prices, prices_path)
+    print(f"Цены: {len(ranges)} инструментов, новых строк {len(rows)}")
+
+
+async def main():
+    limiter = RateLimiter(rate=API_REQUESTS_PER_SECOND, capacity=API_BURST, max_concurrent=MAX_CONCURRENT_REQUESTS)
+    try:
+        await fetch_prices(limiter)
+    finally:
+        print(limiter.report())
+
+
+if __name__ == "__main__":
+    argparse.ArgumentParser(description='Выгрузка дневных цен закрытия для инструментов из operations.csv').parse_args()
+    asyncio.run(main())
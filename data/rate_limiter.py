@@ -0,0 +1,102 @@
+import asyncio
+import random
+import time
+
+
+def is_throttled(error):
+    code = getattr(error, 'code', None)
+    return getattr(code, 'name', None) == 'RESOURCE_EXHAUSTED' or "RESOURCE_EXHAUSTED" in str(error)
+
+
+class RateLimiter:
+    # Token bucket на все запросы к API. При ответе RESOURCE_EXHAUSTED скорость и размер корзины
+    # уменьшаются вдвое, после серии успешных запросов постепенно растут обратно
+    def __init__(self, rate=3.0, capacity=10, max_concurrent=5, max_retries=5, base_delay=0.5, max_delay=30.0,
+                 min_rate=0.2):
+        self.max_rate = rate
+        self.max_capacity = capacity
+        self.min_rate = min_rate
+        self.rate = rate
+        self.capacity = capacity
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.requests = 0
+        self.throttles = 0
+        self.wait_time = 0.0
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._started_at = self._updated_at
+        self._successes = 0
+        self._lock = asyncio.Lock()
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                delay = (1 - self._tokens) / self.rate
+                self.wait_time += delay
+                await asyncio.sleep(delay)
+                self._refill()
+            self._tokens -= 1
+
+    def _on_throttle(self):
+        self.throttles += 1
+        self._successes = 0
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.capacity = max(1, self.capacity // 2)
+        self._tokens = min(self._tokens, 0)
+
+    def _on_success(self):
+        self._successes += 1
+        if self._successes >= self.capacity:
+            self._successes = 0
+            self.rate = min(self.max_rate, self.rate * 1.25)
+            self.capacity = min(self.max_capacity, self.capacity + 1)
+
+    def backoff(self, attempt):
+        # Экспоненциальная задержка с полным джиттером
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def call(self, method, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            await self.acquire()
+            try:
+                async with self._semaphore:
+                    self.requests += 1
+                    result = await method(**kwargs)
+            except Exception as e:
+                if not is_throttled(e) or attempt == self.max_retries:
+                    raise
+                self._on_throttle()
+                delay = self.backoff(attempt)
+                print(f"Лимит запросов исчерпан, попытка {attempt + 1}/{self.max_retries}, "
+                      f"ждем {delay:.1f} секунд")
+                self.wait_time += delay
+                await asyncio.sleep(delay)
+            else:
+                self._on_success()
+                return result
+
+    def metrics(self):
+        elapsed = time.monotonic() - self._started_at
+        return {
+            'requests': self.requests,
+            'throttles': self.throttles,
+            'wait_time': self.wait_time,
+            'requests_per_second': self.requests / elapsed if elapsed > 0 else 0.0,
+            'rate': self.rate,
+            'capacity': self.capacity,
+        }
+
+    def report(self):
+        metrics = self.metrics()
+        return (f"Запросов к API: {metrics['requests']}, ограничений: {metrics['throttles']}, "
+                f"ожидание {metrics['wait_time']:.1f} с, {metrics['requests_per_second']:.1f} запросов/с")
@@ -0,0 +1,82 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Справочник тикер → сектор и необязательные ручные переопределения в том же формате
+SECTORS_PATH = os.getenv('SECTORS_PATH', 'sectors.csv')
+SECTOR_OVERRIDES_PATH = os.getenv('SECTOR_OVERRIDES_PATH', 'sector_overrides.csv')
+DEFAULT_SECTOR = 'Другое'
+# Сектор по типу инструмента и по подстроке в названии, если тикера нет в переопределениях
+TYPE_SECTORS = {'etf': 'Смешанный'}
+NAME_RULES = [('bond', 'ОФЗ', 'Государственный')]
+# Справочник тикеров применяется только к этим типам; валюта, прочие облигации и т. п. — «Другое» по задумке
+MAPPED_TYPES = {'share'}
+
+
+def read_sector_mapping(path):
+    if not os.path.exists(path):
+        return {}
+    mapping = pd.read_csv(path, dtype=str).dropna(subset=['ticker', 'sector'])
+    return dict(zip(mapping['ticker'].str.strip(), mapping['sector'].str.strip()))
+
+
+class SectorIndex:
+    def __init__(self, sectors, overrides=None, type_sectors=TYPE_SECTORS, name_rules=NAME_RULES,
+                 mapped_types=MAPPED_TYPES, default=DEFAULT_SECTOR):
+        self.sectors = dict(sectors)
+        self.overrides = dict(overrides or {})
+        self.type_sectors = type_sectors
+        self.name_rules = name_rules
+        self.mapped_types = set(mapped_types)
+        self.default = default
+
+    @classmethod
+    def from_files(cls, path=SECTORS_PATH, overrides_path=SECTOR_OVERRIDES_PATH):
+        return cls(read_sector_mapping(path), read_sector_mapping(overrides_path))
+
+    def classify(self, ticker, instrument_type, instrument_name):
+        if ticker in self.overrides:
+            return self.overrides[ticker]
+        if instrument_type in self.type_sectors:
+            return self.type_sectors[instrument_type]
+        for rule_type, pattern, sector in self.name_rules:
+            if instrument_type == rule_type and pattern in (instrument_name or ''):
+                return sector
+        if instrument_type in self.mapped_types:
+            return self.sectors.get(ticker, self.default)
+        return self.default
+
+    def classify_frame(self, df):
+        # Порядок: ручное переопределение, правило по типу, правило по названию, справочник (только для
+        # MAPPED_TYPES), значение по умолчанию
+        tickers = df['ticker'].astype(object)
+        types = df['type'].astype(object)
+        names = df['name'].astype(object).fillna('')
+
+        conditions = [tickers.map(self.overrides).notna().to_numpy()]
+        choices = [tickers.map(self.overrides).to_numpy()]
+        for instrument_type, sector in self.type_sectors.items():
+            conditions.append((types == instrument_type).to_numpy())
+            choices.append(sector)
+        for instrument_type, pattern, sector in self.name_rules:
+            conditions.append(((types == instrument_type) & names.str.contains(pattern, regex=False)).to_numpy())
+            choices.append(sector)
+        mapped = tickers.map(self.sectors).where(types.isin(self.mapped_types))
+        conditions.append(mapped.notna().to_numpy())
+        choices.append(mapped.to_numpy())
+        return pd.Series(np.select(conditions, choices, default=self.default), index=df.index, name='sector')
+
+    def unclassified(self, df, sectors=None):
+        if sectors is None:
+            sectors = self.classify_frame(df)
+        # В отчёт попадают только типы, которые должны находиться в справочнике
+        rows = df[(sectors == self.default) & df['type'].astype(object).isin(self.mapped_types)]
+        return rows[['ticker', 'type', 'name']].drop_duplicates('ticker').sort_values('ticker')
+
+    def report(self, df, sectors=None):
+        unclassified = self.unclassified(df, sectors)
+        if unclassified.empty:
+            return "Все инструменты отнесены к секторам"
+        tickers = ', '.join(f"{row.ticker} ({row.type})" for row in unclassified.itertuples())
+        return f"Без сектора ({len(unclassified)}): {tickers}"
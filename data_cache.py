@@ -0,0 +1,93 @@
+import hashlib
+import os
+
+import pandas as pd
+
+from file_utils import read_json, tmp_path, write_json_atomic
+from schema import SCHEMA_VERSION
+
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def dataset_version(*paths):
+    # Версия набора данных меняется вместе с любым из исходных файлов
+    parts = [str(SCHEMA_VERSION)]
+    for path in paths:
+        stat = os.stat(path)
+        parts.append(f"{path}:{stat.st_mtime_ns}:{stat.st_size}")
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+
+def cache_paths(csv_path):
+    cache_path = os.path.splitext(csv_path)[0] + '.feather'
+    return cache_path, cache_path + '.json'
+
+
+def _is_fresh(csv_path, meta_path, stat, version):
+    meta = read_json(meta_path)
+    if not meta or meta.get('schema_version') != SCHEMA_VERSION or meta.get('version', '') != version:
+        return False
+    if meta['mtime_ns'] == stat.st_mtime_ns and meta['size'] == stat.st_size:
+        return True
+    # mtime изменился: кэш остаётся валидным, если содержимое файла то же самое
+    if meta['size'] == stat.st_size and meta['sha1'] == file_hash(csv_path):
+        meta['mtime_ns'] = stat.st_mtime_ns
+        write_json_atomic(meta_path, meta)
+        return True
+    return False
+
+
+def read_cached_csv(csv_path, dtypes, prepare=None, version=''):
+    # version описывает всё, от чего кроме самого CSV зависит результат prepare (например, таблица курсов)
+    cache_path, meta_path = cache_paths(csv_path)
+    stat = os.stat(csv_path)
+
+    if os.path.exists(cache_path) and _is_fresh(csv_path, meta_path, stat, version):
+        try:
+            return pd.read_feather(cache_path)
+        except ImportError:
+            pass
+        except Exception as e:
+            print(f"Не удалось прочитать кэш {cache_path}: {e}")
+
+    sha1 = file_hash(csv_path)
+    df = pd.read_csv(csv_path, dtype=dtypes)
+    if prepare is not None:
+        df = prepare(df)
+    df = df.reset_index(drop=True)
+
+    tmp = tmp_path(cache_path)
+    try:
+        # Без сжатия: воркеры параллельной агрегации отображают файл в память без копирования и распаковки
+        df.to_feather(tmp, compression='uncompressed')
+        os.replace(tmp, cache_path)
+        write_json_atomic(meta_path, {
+            'schema_version': SCHEMA_VERSION,
+            'version': version,
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'sha1': sha1,
+        })
+    except ImportError:
+        # pyarrow не установлен: работаем напрямую с CSV
+        pass
+    except OSError as e:
+        print(f"Не удалось записать кэш {cache_path}: {e}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    return df
+
+
+def fresh_cache_path(csv_path, version=''):
+    # Путь к актуальному Feather-кэшу CSV или None, если кэша нет или он устарел; сам кэш не собирается
+    cache_path, meta_path = cache_paths(csv_path)
+    if os.path.exists(cache_path) and _is_fresh(csv_path, meta_path, os.stat(csv_path), version):
+        return cache_path
+    return None
@@ -1,76 +1,262 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
 import pandas as pd
 
+from data_cache import fresh_cache_path, read_cached_csv
+from fx import convert_columns, fx_version, load_fx_rates
+from metrics import timed
+from xirr import xirr, xirr_by_group
+from schema import OPERATIONS_DTYPES, PORTFOLIO_DTYPES, YEAR_DTYPE, MONTH_DTYPE
 
-def load_data():
-    df_operations = pd.read_csv('data/operations.csv')
-    df_operations['date'] = pd.to_datetime(df_operations['date'], errors='coerce')
-    df_operations['year'] = df_operations['date'].dt.year
-    df_operations = df_operations[df_operations['year'].isin([2020, 2021, 2022, 2023, 2024])]
-    df_portfolio = pd.read_csv('data/portfolio.csv')
-    return df_operations, df_portfolio
+OPERATIONS_PATH = 'data/operations.csv'
+PORTFOLIO_PATH = 'data/portfolio.csv'
 
 
-def process_operations_data(df, portfolio_name=None):
-    if portfolio_name:
-        df = df[df['portfolio_name'] == portfolio_name]  # Фильтрация по брокерскому счёту
+def parse_years(value):
+    start, _, end = value.partition('-')
+    return range(int(start), int(end or start) + 1)
+
+
+# Окно лет для аналитики, например DASHBOARD_YEARS=2019-2025
+YEARS = parse_years(os.getenv('DASHBOARD_YEARS', '2020-2024'))
+# Файлы операций крупнее порога читаются потоково, кусками по CHUNK_SIZE строк
+STREAMING_THRESHOLD_BYTES = int(os.getenv('STREAMING_THRESHOLD_BYTES', 512 * 1024 * 1024))
+CHUNK_SIZE = 500_000
+# Параллельная агрегация по счетам включается на кадрах от PARALLEL_MIN_ROWS строк и хотя бы двух воркерах
+AGGREGATION_WORKERS = int(os.getenv('DASHBOARD_AGGREGATION_WORKERS', os.cpu_count() or 1))
+# Пул создаётся из фонового потока многопоточного сервера: fork такого процесса может унаследовать чужие
+# захваченные блокировки, поэтому воркеры запускаются через forkserver (на Windows и macOS — spawn)
+AGGREGATION_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+PARALLEL_MIN_ROWS = int(os.getenv('PARALLEL_MIN_ROWS', 2_000_000))
+
+TAX_TYPES = [
+    'Удержание налога по дивидендам',
+    'Удержание налога',
+    'Корректировка налога',
+    'Удержание НДФЛ по купонам'
+]
+COMMISSION_TYPES = ['Удержание комиссии за операцию']
+COUPON_TYPE = 'Выплата купонов'
+DIVIDEND_TYPE = 'Выплата дивидендов'
+PAYMENT_TYPES = [DIVIDEND_TYPE, COUPON_TYPE]
+DEPOSIT_TYPE = 'Пополнение брокерского счёта'
+WITHDRAWAL_TYPE = 'Вывод денежных средств'
+INPUT_OUTPUT_TYPES = [DEPOSIT_TYPE, WITHDRAWAL_TYPE]
+# Типы операций, которые попадают в аналитику; остальные отбрасываются при агрегации
+REPORTED_TYPES = TAX_TYPES + COMMISSION_TYPES + PAYMENT_TYPES + INPUT_OUTPUT_TYPES
+
+
+# Денежные колонки, которые приводятся к валюте отчёта
+OPERATIONS_MONEY_COLUMNS = ['amount', 'payment']
+PORTFOLIO_MONEY_COLUMNS = ['average_price', 'current_price', 'expected_yield']
+
+
+def parse_operation_dates(df):
+    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    df['year'] = df['date'].dt.year
+    df['month'] = df['date'].dt.month
+    return df
+
+
+def prepare_operations(df, rates=None):
+    # Суммы пересчитываются по курсу на дату операции
+    df = parse_operation_dates(df)
+    return convert_columns(df, [column for column in OPERATIONS_MONEY_COLUMNS if column in df.columns], 'date', rates)
 
-    tax_types = [
-        'Удержание налога по дивидендам',
-        'Удержание налога',
-        'Корректировка налога',
-        'Удержание НДФЛ по купонам'
-    ]
-    commission_types = ['Удержание комиссии за операцию']
 
-    total_taxes = df[df['type'].isin(tax_types)]['amount'].sum()
-    total_commissions = df[df['type'].isin(commission_types)]['amount'].sum()
+def prepare_portfolio(df, rates=None):
+    # Цены позиций пересчитываются по последнему известному курсу
+    df = convert_columns(df, [column for column in PORTFOLIO_MONEY_COLUMNS if column in df.columns], rates=rates)
+    return add_portfolio_values(df)
 
-    payments_df = df[df['type'].isin(['Выплата дивидендов', 'Выплата купонов'])]
-    payments_analytics = payments_df.groupby(['year', 'type'])['amount'].sum().reset_index()
 
-    input_output_df = df[df['type'].isin(['Пополнение брокерского счёта', 'Вывод денежных средств'])]
-    input_output_df['amount'] = input_output_df.apply(
-        lambda row: row['amount'] if row['type'] == 'Пополнение брокерского счёта' else -row['amount'], axis=1
+def add_portfolio_values(df):
+    # Стоимость позиций считается один раз при загрузке, а не в каждом callback
+    return df.assign(
+        current_value=df['quantity'] * df['current_price'],
+        investment_value=df['quantity'] * df['average_price']
     )
-    input_output_yearly = input_output_df.groupby(['year', 'type', 'portfolio_name'])['amount'].sum().reset_index()
-    input_output_yearly['account'] = input_output_yearly['portfolio_name']
 
-    operations_summary = {
-        'total_coupons': payments_df[payments_df['type'] == 'Выплата купонов']['amount'].sum(),
-        'total_dividends': payments_df[payments_df['type'] == 'Выплата дивидендов']['amount'].sum(),
-        'total_deposits': input_output_df[input_output_df['type'] == 'Пополнение брокерского счёта']['amount'].sum(),
-        'total_withdrawals': -1 * input_output_df[input_output_df['type'] == 'Вывод денежных средств']['amount'].sum(),
+
+def with_portfolio_values(df):
+    if 'current_value' in df.columns and 'investment_value' in df.columns:
+        return df
+    return add_portfolio_values(df)
+
+
+def filter_years(df, years):
+    df = df[df['year'].isin(list(years))]
+    return df.astype({'year': YEAR_DTYPE, 'month': MONTH_DTYPE})
+
+
+def load_portfolio():
+    return read_cached_csv(PORTFOLIO_PATH, PORTFOLIO_DTYPES, prepare=prepare_portfolio, version=fx_version())
+
+
+def load_operations():
+    # Вся история операций без фильтра по годам
+    return read_cached_csv(OPERATIONS_PATH, OPERATIONS_DTYPES, prepare=prepare_operations, version=fx_version())
+
+
+@timed('load_data')
+def load_data(years=YEARS):
+    return filter_years(load_operations(), years), load_portfolio()
+
+
+def iter_operation_chunks(path=OPERATIONS_PATH, chunksize=CHUNK_SIZE):
+    # Даты разбираются в каждом куске, в памяти не бывает больше одного куска сырых строк
+    rates = load_fx_rates()
+    for chunk in pd.read_csv(path, dtype=OPERATIONS_DTYPES, chunksize=chunksize):
+        yield prepare_operations(chunk, rates)
+
+
+def merge_operation_cubes(partial_cubes):
+    if not partial_cubes:
+        return pd.DataFrame(columns=['portfolio_name', 'year', 'month', 'type', 'amount'])
+    return pd.concat(partial_cubes, ignore_index=True).groupby(
+        ['portfolio_name', 'year', 'month', 'type'], dropna=False, observed=True
+    )['amount'].sum().reset_index()
+
+
+def merge_cash_flows(partial_flows):
+    if not partial_flows:
+        return pd.DataFrame(columns=['portfolio_name', 'date', 'amount'])
+    return pd.concat(partial_flows, ignore_index=True).groupby(
+        ['portfolio_name', 'date'], observed=True
+    )['amount'].sum().reset_index()
+
+
+def aggregate_operations_streaming(path=OPERATIONS_PATH, years=YEARS, chunksize=CHUNK_SIZE):
+    # Потоки для XIRR берутся из всей истории: текущая стоимость портфеля включает и то, что куплено вне окна лет
+    partial_cubes, partial_flows = [], []
+    for chunk in iter_operation_chunks(path, chunksize):
+        partial_flows.append(aggregate_cash_flows(chunk))
+        partial_cubes.append(aggregate_operations(filter_years(chunk, years)))
+    return merge_operation_cubes(partial_cubes), merge_cash_flows(partial_flows)
+
+
+def partition_accounts(row_counts, n_partitions):
+    # Счета раскладываются по воркерам жадно, начиная с крупных, чтобы строк у всех было поровну
+    partitions = [[] for _ in range(min(n_partitions, len(row_counts)))]
+    loads = [0] * len(partitions)
+    for account, rows in row_counts.sort_values(ascending=False).items():
+        lightest = loads.index(min(loads))
+        partitions[lightest].append(account)
+        loads[lightest] += rows
+    return partitions
+
+
+def _aggregate_partition(cache_path, accounts, years):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    # Воркер отображает несжатый Feather-кэш в память и копирует только строки своих счетов
+    with pa.memory_map(cache_path) as source:
+        table = pa.ipc.open_file(source).read_all()
+        table = table.filter(pc.is_in(table['portfolio_name'], value_set=pa.array(accounts)))
+        df = table.to_pandas()
+    return aggregate_operations(filter_years(df, years)), aggregate_cash_flows(df)
+
+
+def aggregation_context():
+    context = multiprocessing.get_context(AGGREGATION_START_METHOD)
+    if AGGREGATION_START_METHOD == 'forkserver':
+        # Сервер запуска один раз импортирует этот модуль с pandas, воркеры получают его готовым.
+        # Без явного списка он импортировал бы __main__, то есть app.py со своим потоком обновления
+        context.set_forkserver_preload([__name__])
+    return context
+
+
+def aggregate_operations_parallel(cache_path, row_counts, years=YEARS, workers=AGGREGATION_WORKERS):
+    partitions = partition_accounts(row_counts, workers)
+    with ProcessPoolExecutor(max_workers=len(partitions), mp_context=aggregation_context()) as executor:
+        results = list(executor.map(_aggregate_partition, repeat(cache_path), partitions, repeat(years)))
+    partial_cubes, partial_flows = zip(*results)
+    return merge_operation_cubes(list(partial_cubes)), merge_cash_flows(list(partial_flows))
+
+
+def parallel_row_counts(workers=AGGREGATION_WORKERS, min_rows=PARALLEL_MIN_ROWS):
+    # Feather-кэш и число строк по счетам, если кадр достаточно велик для пула процессов, иначе (None, None).
+    # Пул читает только уже готовый кэш: если его приходится собирать, кадр и так оказывается в памяти
+    # и считается последовательно, а не читается воркерами второй раз
+    if workers <= 1:
+        return None, None
+    cache_path = fresh_cache_path(OPERATIONS_PATH, fx_version())
+    if cache_path is None:
+        return None, None
+    row_counts = pd.read_feather(cache_path, columns=['portfolio_name'])['portfolio_name'].value_counts()
+    row_counts = row_counts[row_counts > 0]
+    if len(row_counts) < 2 or row_counts.sum() < min_rows:
+        return None, None
+    return cache_path, row_counts
+
+
+@timed('load_aggregates')
+def load_aggregates(years=YEARS):
+    streaming = os.path.getsize(OPERATIONS_PATH) > STREAMING_THRESHOLD_BYTES
+    cache_path, row_counts = (None, None) if streaming else parallel_row_counts()
+
+    if streaming:
+        df_portfolio = load_portfolio()
+        operations_cube, cash_flows = aggregate_operations_streaming(OPERATIONS_PATH, years)
+        portfolio_cube = aggregate_portfolio(df_portfolio)
+    elif cache_path is not None:
+        df_portfolio = load_portfolio()
+        operations_cube, cash_flows = aggregate_operations_parallel(cache_path, row_counts, years)
+        portfolio_cube = aggregate_portfolio(df_portfolio)
+    else:
+        df_history, df_portfolio = load_operations(), load_portfolio()
+        operations_cube, portfolio_cube = build_aggregates(filter_years(df_history, years), df_portfolio)
+        cash_flows = aggregate_cash_flows(df_history)
+
+    # Стоимость портфеля из portfolio.csv относится к моменту его выгрузки
+    valuation_date = pd.Timestamp(os.path.getmtime(PORTFOLIO_PATH), unit='s').normalize()
+    return {
+        'operations_cube': operations_cube,
+        'portfolio_cube': portfolio_cube,
+        'cash_flows': cash_flows,
+        'valuation_date': valuation_date,
+        'account_returns': money_weighted_returns(cash_flows, portfolio_cube, valuation_date),
+        'broker_accounts': df_portfolio['portfolio_name'].unique(),
     }
 
-    return total_taxes, total_commissions, payments_analytics, input_output_yearly, operations_summary
 
+@timed('process_operations_data')
+def process_operations_data(df, portfolio_name=None):
+    if portfolio_name:
+        df = df[df['portfolio_name'] == portfolio_name]  # Фильтрация по брокерскому счёту
+
+    return summarize_operations(aggregate_operations(df))
 
 
+@timed('process_portfolio_data')
 def process_portfolio_data(df, portfolio_name=None):
     if portfolio_name:
         df = df[df['portfolio_name'] == portfolio_name]  # Фильтрация по брокерскому счёту
 
-    df['current_value'] = df['quantity'] * df['current_price']
-    df['investment_value'] = df['quantity'] * df['average_price']
+    df = with_portfolio_values(df)
 
     total_portfolio_value = df['current_value'].sum()
     total_profitability = ((df['current_value'].sum() - df['investment_value'].sum()) / df[
         'investment_value'].sum()) * 100 if df['investment_value'].sum() > 0 else 0
 
-    detailed_data = df.groupby('type').agg(
+    detailed_data = df.groupby('type', observed=True).agg(
         total_value=('current_value', 'sum')
     ).reset_index()
 
-    sunburst_data = df.groupby(['type', 'portfolio_name']).agg(
+    sunburst_data = df.groupby(['type', 'portfolio_name'], observed=True).agg(
         total_value=('current_value', 'sum')
     ).reset_index()
 
-    treemap_data = df.groupby(['sector', 'name']).agg(
+    treemap_data = df.groupby(['sector', 'name'], observed=True).agg(
         total_quantity=('quantity', 'sum'),
         total_value=('current_value', 'sum')
     ).reset_index()
 
-    grouped_data = df.groupby(['ticker', 'name', 'type']).agg(
+    grouped_data = df.groupby(['ticker', 'name', 'type'], observed=True).agg(
         total_quantity=('quantity', 'sum'),
         average_price=('average_price', 'mean'),
         current_price=('current_price', 'mean')
@@ -78,3 +264,130 @@ def process_portfolio_data(df, portfolio_name=None):
 
     return detailed_data, sunburst_data, treemap_data, total_portfolio_value, total_profitability, grouped_data
 
+
+
+# Предагрегированные данные: частичные суммы по счетам, из которых собирается любая выборка счетов
+PORTFOLIO_KEYS = ['portfolio_name', 'type', 'sector', 'ticker', 'name']
+
+
+def aggregate_operations(df):
+    # Тип операции кодируется один раз, после чего всё считается одной группировкой.
+    # Куб помесячный: из него же строятся префиксные суммы для выборки по диапазону дат
+    operation_type = pd.Series(pd.Categorical(df['type'], categories=REPORTED_TYPES), index=df.index, name='type')
+    reported = operation_type.notna().to_numpy()
+    # Кадры, подготовленные без parse_operation_dates (например, в process_operations_data), месяц берут из даты
+    month = df['month'] if 'month' in df.columns else pd.to_datetime(df['date'], errors='coerce').dt.month
+    operations_cube = df['amount'][reported].groupby(
+        [df['portfolio_name'][reported], df['year'][reported], month[reported], operation_type[reported]],
+        dropna=False, observed=True
+    ).sum().reset_index()
+    operations_cube['type'] = operations_cube['type'].astype(object)
+    return operations_cube
+
+
+def aggregate_portfolio(df):
+    df = with_portfolio_values(df)
+    return df.groupby(PORTFOLIO_KEYS, dropna=False, observed=True).agg(
+        quantity=('quantity', 'sum'),
+        current_value=('current_value', 'sum'),
+        investment_value=('investment_value', 'sum'),
+        average_price_sum=('average_price', 'sum'),
+        average_price_count=('average_price', 'count'),
+        current_price_sum=('current_price', 'sum'),
+        current_price_count=('current_price', 'count')
+    ).reset_index()
+
+
+def build_aggregates(df_operations, df_portfolio):
+    return aggregate_operations(df_operations), aggregate_portfolio(df_portfolio)
+
+
+def aggregate_cash_flows(df):
+    # Пополнения и выводы по дням с точки зрения инвестора: пополнение — отток, вывод — приток
+    flows = df[df['type'].isin(INPUT_OUTPUT_TYPES)]
+    amount = flows['amount'].where(flows['type'] == WITHDRAWAL_TYPE, -flows['amount'])
+    date = flows['date'].dt.tz_localize(None) if flows['date'].dt.tz is not None else flows['date']
+    return amount.groupby([flows['portfolio_name'], date.dt.normalize()], observed=True).sum().reset_index()
+
+
+def money_weighted_returns(cash_flows, portfolio_cube, valuation_date):
+    # XIRR всех счетов решается одним батчем: потоки плюс текущая стоимость счёта на дату оценки
+    values = portfolio_cube.groupby('portfolio_name', observed=True)['current_value'].sum()
+    terminal_values = pd.DataFrame({'portfolio_name': values.index, 'date': valuation_date, 'amount': values.to_numpy()})
+    flows = pd.concat([cash_flows, terminal_values], ignore_index=True)
+    return xirr_by_group(flows['portfolio_name'].astype(object), flows['date'], flows['amount'])
+
+
+def selection_money_weighted_return(cash_flows, total_portfolio_value, valuation_date):
+    dates = pd.DatetimeIndex(cash_flows['date']).append(pd.DatetimeIndex([valuation_date]))
+    return xirr(dates, list(cash_flows['amount']) + [total_portfolio_value])
+
+
+@timed('filter')
+def select_accounts(cube, accounts):
+    if isinstance(accounts, str):
+        accounts = [accounts]
+    return cube[cube['portfolio_name'].isin(accounts)]
+
+
+@timed('summarize_operations')
+def summarize_operations(operations_cube):
+    amounts_by_type = operations_cube.groupby('type', observed=True)['amount'].sum()
+    total_taxes = amounts_by_type.reindex(TAX_TYPES).sum()
+    total_commissions = amounts_by_type.reindex(COMMISSION_TYPES).sum()
+
+    payments_cube = operations_cube[operations_cube['type'].isin(PAYMENT_TYPES)]
+    payments_analytics = payments_cube.groupby(['year', 'type'], observed=True)['amount'].sum().reset_index()
+
+    input_output_cube = operations_cube[operations_cube['type'].isin(INPUT_OUTPUT_TYPES)]
+    signed_amount = input_output_cube['amount'].where(
+        input_output_cube['type'] == DEPOSIT_TYPE, -input_output_cube['amount']
+    )
+    input_output_yearly = input_output_cube.assign(amount=signed_amount).groupby(
+        ['year', 'type', 'portfolio_name'], observed=True)['amount'].sum().reset_index()
+    input_output_yearly['account'] = input_output_yearly['portfolio_name']
+
+    operations_summary = {
+        'total_coupons': amounts_by_type.get(COUPON_TYPE, 0),
+        'total_dividends': amounts_by_type.get(DIVIDEND_TYPE, 0),
+        'total_deposits': amounts_by_type.get(DEPOSIT_TYPE, 0),
+        'total_withdrawals': amounts_by_type.get(WITHDRAWAL_TYPE, 0),
+    }
+
+    return total_taxes, total_commissions, payments_analytics, input_output_yearly, operations_summary
+
+
+@timed('summarize_portfolio')
+def summarize_portfolio(portfolio_cube):
+    total_portfolio_value = portfolio_cube['current_value'].sum()
+    total_investment_value = portfolio_cube['investment_value'].sum()
+    total_profitability = ((total_portfolio_value - total_investment_value) /
+                           total_investment_value) * 100 if total_investment_value > 0 else 0
+
+    detailed_data = portfolio_cube.groupby('type', observed=True).agg(
+        total_value=('current_value', 'sum')
+    ).reset_index()
+
+    sunburst_data = portfolio_cube.groupby(['type', 'portfolio_name'], observed=True).agg(
+        total_value=('current_value', 'sum')
+    ).reset_index()
+
+    treemap_data = portfolio_cube.groupby(['sector', 'name'], observed=True).agg(
+        total_quantity=('quantity', 'sum'),
+        total_value=('current_value', 'sum')
+    ).reset_index()
+
+    grouped_sums = portfolio_cube.groupby(['ticker', 'name', 'type'], observed=True).agg(
+        total_quantity=('quantity', 'sum'),
+        average_price_sum=('average_price_sum', 'sum'),
+        average_price_count=('average_price_count', 'sum'),
+        current_price_sum=('current_price_sum', 'sum'),
+        current_price_count=('current_price_count', 'sum')
+    )
+    grouped_data = pd.DataFrame({
+        'total_quantity': grouped_sums['total_quantity'],
+        'average_price': grouped_sums['average_price_sum'] / grouped_sums['average_price_count'],
+        'current_price': grouped_sums['current_price_sum'] / grouped_sums['current_price_count']
+    }).reset_index()
+
+    return detailed_data, sunburst_data, treemap_data, total_portfolio_value, total_profitability, grouped_data
@@ -0,0 +1,45 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: gunicorn там не работает, дашборд идёт одним процессом и блокировки не нужны
+    fcntl = None
+
+
+def tmp_path(path):
+    # Один файл могут одновременно писать несколько воркеров: у каждого процесса и потока свой временный файл,
+    # на место готовый файл встаёт через os.replace
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def read_json(path, default=None):
+    try:
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json_atomic(path, value):
+    tmp = tmp_path(path)
+    with open(tmp, 'w', encoding='utf-8') as file:
+        json.dump(value, file)
+    os.replace(tmp, path)
+
+
+@contextmanager
+def file_lock(path, blocking=True):
+    # Блокировка между процессами на файле path. Отдаёт открытый файл блокировки, а при blocking=False —
+    # None, если блокировку держит другой процесс. Снимается при закрытии файла
+    with open(path, 'a+') as file:
+        if fcntl is not None:
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield None
+                return
+        yield file
@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_cache import dataset_version
+
+# Курсы валют: date,currency,rate — сколько рублей стоит единица валюты на дату
+FX_RATES_PATH = os.getenv('FX_RATES_PATH', 'data/fx_rates.csv')
+BASE_CURRENCY = 'rub'
+# Валюта, в которую приводятся все суммы дашборда
+REPORTING_CURRENCY = os.getenv('DASHBOARD_CURRENCY', BASE_CURRENCY).lower()
+
+
+def fx_version(path=FX_RATES_PATH, reporting=REPORTING_CURRENCY):
+    # Входит в версию кэшей: пересчитанные суммы зависят от таблицы курсов и валюты отчёта
+    return f"{reporting}:{dataset_version(path) if os.path.exists(path) else 'none'}"
+
+
+def load_fx_rates(path=FX_RATES_PATH):
+    if not os.path.exists(path):
+        return pd.DataFrame({'date': pd.Series(dtype='datetime64[ns]'), 'currency': pd.Series(dtype=object),
+                             'rate': pd.Series(dtype='float64')})
+    rates = pd.read_csv(path, dtype={'currency': str, 'rate': 'float64'})
+    rates['currency'] = rates['currency'].str.strip().str.lower()
+    rates['date'] = pd.to_datetime(rates['date'], utc=True).dt.tz_localize(None).astype('datetime64[ns]')
+    return rates.dropna().sort_values('date', ignore_index=True)
+
+
+def naive_dates(dates):
+    dates = pd.Series(dates)
+    if isinstance(dates.dtype, pd.DatetimeTZDtype):
+        dates = dates.dt.tz_convert('UTC').dt.tz_localize(None)
+    return dates.astype('datetime64[ns]')
+
+
+def rates_to_base(currencies, dates, rates):
+    # Курс к рублю на дату каждой строки одним merge_asof по всему кадру: последний известный курс не позже даты,
+    # для дат раньше первой записи — самый ранний курс валюты
+    currencies = pd.Series(currencies).astype(object).str.lower().fillna(BASE_CURRENCY).to_numpy()
+    dates = naive_dates(dates).to_numpy()
+    result = np.ones(len(currencies))
+    foreign = currencies != BASE_CURRENCY
+    if not foreign.any():
+        return result
+
+    lookup = pd.DataFrame({'currency': currencies[foreign], 'date': dates[foreign],
+                           'row': np.flatnonzero(foreign)})
+    # Строки без даты (позиции портфеля, битые даты) получают последний курс
+    lookup['date'] = lookup['date'].fillna(pd.Timestamp.max)
+    matched = pd.merge_asof(lookup.sort_values('date'), rates, on='date', by='currency', direction='backward')
+    earliest = rates.groupby('currency')['rate'].first()
+    matched['rate'] = matched['rate'].fillna(matched['currency'].map(earliest))
+    result[matched['row'].to_numpy()] = matched['rate'].to_numpy()
+    return result
+
+
+def conversion_factors(currencies, dates, rates, reporting=REPORTING_CURRENCY):
+    # Для валют без курса множитель NaN: такие суммы нельзя складывать с остальными ни как рубли, ни как валюту отчёта
+    factors = rates_to_base(currencies, dates, rates)
+    missing = pd.Series(currencies).astype(object).str.lower()[np.isnan(factors)].unique()
+    if len(missing):
+        print(f"Нет курса для валют: {', '.join(map(str, missing))}, строки в этих валютах исключены")
+    if reporting != BASE_CURRENCY:
+        reporting_rates = rates_to_base(np.full(len(factors), reporting, dtype=object), dates, rates)
+        if np.isnan(reporting_rates).any():
+            raise ValueError(f"В {FX_RATES_PATH} нет курса валюты отчёта {reporting}")
+        factors = factors / reporting_rates
+    return factors
+
+
+def convert_columns(df, columns, date_column=None, rates=None, reporting=REPORTING_CURRENCY):
+    if 'currency' not in df.columns:
+        return df
+    if rates is None:
+        rates = load_fx_rates()
+    dates = df[date_column] if date_column else pd.Series(pd.NaT, index=df.index)
+    factors = conversion_factors(df['currency'], dates, rates, reporting)
+    known = ~np.isnan(factors)
+    if not known.all():
+        df, factors = df[known], factors[known]
+    if (factors == 1.0).all():
+        return df
+    return df.assign(**{column: (df[column] * factors).astype(df[column].dtype) for column in columns})
@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+# Замеры этапов обработки; при DASHBOARD_METRICS=0 декораторы возвращают исходные функции
+METRICS_ENABLED = os.getenv('DASHBOARD_METRICS', '1') == '1'
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[index] += 1
+                    break
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.count, self.sum
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def observe(stage, seconds):
+    histogram = _histograms.get(stage)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(stage, Histogram())
+    histogram.observe(seconds)
+
+
+@contextmanager
+def _stage_timer(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def stage_timer(stage):
+    return _stage_timer(stage) if METRICS_ENABLED else nullcontext()
+
+
+def timed(stage):
+    def decorator(function):
+        if not METRICS_ENABLED:
+            return function
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def render_prometheus(name='dashboard_stage_seconds'):
+    lines = [f'# HELP {name} Время этапов обработки запросов дашборда', f'# TYPE {name} histogram']
+    with _histograms_lock:
+        histograms = sorted(_histograms.items())
+    for stage, histogram in histograms:
+        counts, count, total = histogram.snapshot()
+        cumulative = 0
+        for bound, bucket_count in zip(histogram.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {count}')
+        lines.append(f'{name}_sum{{stage="{stage}"}} {total}')
+        lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,203 @@
+import hashlib
+import importlib.util
+import os
+import sqlite3
+import urllib.parse
+from abc import ABC, abstractmethod
+
+import pandas as pd
+
+from data_cache import read_cached_csv
+from data_processing import (iter_operation_chunks, prepare_operations, prepare_portfolio, REPORTED_TYPES,
+                             OPERATIONS_PATH, PORTFOLIO_PATH, STREAMING_THRESHOLD_BYTES)
+from file_utils import file_lock, tmp_path
+from fx import fx_version
+from schema import OPERATIONS_DTYPES, PORTFOLIO_DTYPES, YEAR_DTYPE
+
+# Необязательный SQL-слой: DASHBOARD_QUERY_BACKEND=sqlite или duckdb, по умолчанию выборки считает pandas
+QUERY_BACKEND = os.getenv('DASHBOARD_QUERY_BACKEND', 'pandas')
+# Префикс файлов базы: на каждую версию данных свой файл data/analytics-<хэш версии>.sqlite
+QUERY_DATABASE_PATH = os.getenv('QUERY_DATABASE_PATH', 'data/analytics')
+# Сколько последних версий держать на диске: запросы, начатые до подмены набора данных, дочитывают прежнюю
+KEEP_VERSIONS = 2
+
+OPERATION_COLUMNS = ['portfolio_name', 'year', 'type', 'amount']
+PORTFOLIO_COLUMNS = ['portfolio_name', 'type', 'sector', 'ticker', 'name', 'quantity', 'current_value',
+                     'investment_value', 'average_price', 'current_price']
+
+SCHEMA = [
+    'CREATE TABLE operations (portfolio_name TEXT, year INTEGER, type TEXT, amount DOUBLE)',
+    'CREATE TABLE portfolio (portfolio_name TEXT, type TEXT, sector TEXT, ticker TEXT, name TEXT, quantity DOUBLE, '
+    'current_value DOUBLE, investment_value DOUBLE, average_price DOUBLE, current_price DOUBLE)',
+]
+# Индексы под фильтры выборки: счёт, затем год
+INDEXES = [
+    'CREATE INDEX operations_account_year ON operations (portfolio_name, year, type)',
+    'CREATE INDEX portfolio_account ON portfolio (portfolio_name)',
+]
+
+OPERATIONS_CUBE_QUERY = (
+    'SELECT portfolio_name, year, type, SUM(amount) AS amount FROM operations '
+    'WHERE portfolio_name IN ({accounts}) AND year BETWEEN ? AND ? AND type IN ({types}) '
+    'GROUP BY portfolio_name, year, type'
+)
+PORTFOLIO_CUBE_QUERY = (
+    'SELECT portfolio_name, type, sector, ticker, name, SUM(quantity) AS quantity, '
+    'SUM(current_value) AS current_value, SUM(investment_value) AS investment_value, '
+    'SUM(average_price) AS average_price_sum, COUNT(average_price) AS average_price_count, '
+    'SUM(current_price) AS current_price_sum, COUNT(current_price) AS current_price_count '
+    'FROM portfolio WHERE portfolio_name IN ({accounts}) '
+    'GROUP BY portfolio_name, type, sector, ticker, name'
+)
+
+
+def placeholders(values):
+    return ', '.join('?' * len(values))
+
+
+def operation_frames(path=OPERATIONS_PATH):
+    # Все годы без фильтра: окно лет задаётся в запросе
+    if os.path.getsize(path) > STREAMING_THRESHOLD_BYTES:
+        for chunk in iter_operation_chunks(path):
+            yield chunk[OPERATION_COLUMNS]
+    else:
+        yield read_cached_csv(path, OPERATIONS_DTYPES, prepare=prepare_operations, version=fx_version())[
+            OPERATION_COLUMNS]
+
+
+def portfolio_frame(path=PORTFOLIO_PATH):
+    return read_cached_csv(path, PORTFOLIO_DTYPES, prepare=prepare_portfolio, version=fx_version())[PORTFOLIO_COLUMNS]
+
+
+def plain_columns(df):
+    # Категории передаются в базу как обычные строки
+    return df.astype({column: object for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)})
+
+
+class QueryBackend(ABC):
+    # Таблицы строятся один раз на версию набора данных в отдельном файле. Запрос идёт в файл той версии,
+    # с которой работает callback, поэтому подмена набора данных не смешивает старые кубы с новыми таблицами
+    extension = ''
+
+    def __init__(self, path=QUERY_DATABASE_PATH):
+        self.path = path
+
+    @abstractmethod
+    def connect(self, path, read_only=False):
+        pass
+
+    @abstractmethod
+    def insert(self, connection, table, df):
+        pass
+
+    @abstractmethod
+    def read(self, connection, sql, params):
+        pass
+
+    def database_path(self, version):
+        return f"{self.path}-{hashlib.sha1(version.encode('utf-8')).hexdigest()[:16]}{self.extension}"
+
+    def query(self, version, sql, params):
+        # Соединение на запрос: его не нужно делить между потоками, а открытие файла дешёвое
+        connection = self.connect(self.database_path(version), read_only=True)
+        try:
+            return self.read(connection, sql, params)
+        finally:
+            connection.close()
+
+    def ensure(self, version):
+        path = self.database_path(version)
+        if os.path.exists(path):
+            return
+        # Таблицы одной версии строит один процесс, остальные ждут и открывают готовый файл
+        with file_lock(self.path + '.lock'):
+            if not os.path.exists(path):
+                self.build(path)
+                self.remove_stale()
+
+    def build(self, path):
+        # Готовая база появляется под своим именем целиком
+        tmp = tmp_path(path)
+        connection = self.connect(tmp)
+        try:
+            for statement in SCHEMA:
+                connection.execute(statement)
+            for df in operation_frames():
+                self.insert(connection, 'operations', plain_columns(df))
+            self.insert(connection, 'portfolio', plain_columns(portfolio_frame()))
+            for statement in INDEXES:
+                connection.execute(statement)
+            connection.commit()
+            connection.close()
+            os.replace(tmp, path)
+        except BaseException:
+            connection.close()
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def remove_stale(self, keep=KEEP_VERSIONS):
+        directory, prefix = os.path.split(self.path)
+        directory = directory or '.'
+        paths = [os.path.join(directory, name) for name in os.listdir(directory)
+                 if name.startswith(prefix + '-') and name.endswith(self.extension)]
+        for path in sorted(paths, key=os.path.getmtime, reverse=True)[keep:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def operations_cube(self, accounts, years, version):
+        accounts = list(accounts)
+        sql = OPERATIONS_CUBE_QUERY.format(accounts=placeholders(accounts), types=placeholders(REPORTED_TYPES))
+        cube = self.query(version, sql, accounts + [years.start, years.stop - 1] + REPORTED_TYPES)
+        return cube.astype({'year': YEAR_DTYPE})
+
+    def portfolio_cube(self, accounts, version):
+        accounts = list(accounts)
+        return self.query(version, PORTFOLIO_CUBE_QUERY.format(accounts=placeholders(accounts)), accounts)
+
+
+class SqliteBackend(QueryBackend):
+    extension = '.sqlite'
+
+    def connect(self, path, read_only=False):
+        if read_only:
+            # mode=ro не создаёт пустую базу на месте удалённого файла
+            return sqlite3.connect(f"file:{urllib.parse.quote(os.path.abspath(path))}?mode=ro", uri=True)
+        return sqlite3.connect(path)
+
+    def insert(self, connection, table, df):
+        df.to_sql(table, connection, if_exists='append', index=False, chunksize=100_000)
+
+    def read(self, connection, sql, params):
+        return pd.read_sql_query(sql, connection, params=params)
+
+
+class DuckDBBackend(QueryBackend):
+    extension = '.duckdb'
+
+    def connect(self, path, read_only=False):
+        import duckdb
+        return duckdb.connect(path, read_only=read_only)
+
+    def insert(self, connection, table, df):
+        connection.register('frame', df)
+        connection.execute(f'INSERT INTO {table} SELECT * FROM frame')
+        connection.unregister('frame')
+
+    def read(self, connection, sql, params):
+        return connection.execute(sql, params).df()
+
+
+def create_backend(kind=QUERY_BACKEND, path=QUERY_DATABASE_PATH):
+    if kind == 'pandas':
+        return None
+    if kind == 'sqlite':
+        return SqliteBackend(path)
+    if kind == 'duckdb':
+        if importlib.util.find_spec('duckdb') is None:
+            print("duckdb не установлен, используется sqlite")
+            return SqliteBackend(path)
+        return DuckDBBackend(path)
+    raise ValueError(f"Неизвестный DASHBOARD_QUERY_BACKEND: {kind}")
@@ -0,0 +1,173 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from data_cache import dataset_version
+from file_utils import file_lock
+from fx import fx_version
+from data_processing import load_aggregates, OPERATIONS_PATH, PORTFOLIO_PATH, YEARS
+from metrics import observe
+from result_store import get_or_compute, store_key
+from time_index import OperationsTimeIndex
+
+# Интервал проверки файлов данных и интервал запуска выгрузки из API (0 — выгрузка не запускается)
+RELOAD_CHECK_SECONDS = float(os.getenv('DASHBOARD_RELOAD_CHECK_SECONDS', '30'))
+FETCH_INTERVAL_SECONDS = float(os.getenv('DASHBOARD_FETCH_INTERVAL_SECONDS', '0'))
+RETRY_SECONDS = 5
+FETCH_TIMEOUT_SECONDS = float(os.getenv('DASHBOARD_FETCH_TIMEOUT_SECONDS', '1800'))
+FETCH_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'api.py')
+# Общий для всех воркеров файл блокировки выгрузки
+FETCH_LOCK_PATH = os.path.join(os.path.dirname(FETCH_SCRIPT), '.fetch.lock')
+
+
+def current_version(years=YEARS):
+    # Агрегаты в хранилище результатов привязаны и к файлам данных, и к курсам валют
+    return dataset_version(OPERATIONS_PATH, PORTFOLIO_PATH) + f":{years.start}-{years.stop - 1}:{fx_version()}"
+
+
+def run_fetch(script=FETCH_SCRIPT, timeout=FETCH_TIMEOUT_SECONDS):
+    # Выгрузка идёт в отдельном процессе и не занимает GIL процесса с дашбордом
+    subprocess.run([sys.executable, os.path.basename(script)], cwd=os.path.dirname(script),
+                   check=True, timeout=timeout)
+
+
+def read_fetch_time(lock_file):
+    # В файле блокировки хранится время последней удачной выгрузки любого из воркеров
+    lock_file.seek(0)
+    try:
+        return float(lock_file.read())
+    except ValueError:
+        return None
+
+
+def write_fetch_time(lock_file, timestamp):
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(f"{timestamp:.3f}")
+    lock_file.flush()
+
+
+class DatasetRefresher:
+    # Держит текущий набор агрегатов и подменяет его целиком после пересборки в фоновом потоке.
+    # Callback берут снимок через current и никогда не ждут обновления; до первой сборки current равен None
+    def __init__(self, store, check_interval=RELOAD_CHECK_SECONDS, fetch_interval=FETCH_INTERVAL_SECONDS,
+                 query_backend=None, fetch_lock_path=FETCH_LOCK_PATH):
+        self.store = store
+        self.query_backend = query_backend
+        self.check_interval = check_interval
+        self.fetch_interval = fetch_interval
+        self.fetch_lock_path = fetch_lock_path
+        self.last_refresh = None
+        self.last_fetch = None
+        self.last_error = None
+        self._seen_version = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._ready = threading.Event()
+        self.current = None
+
+    def build(self, version):
+        start = time.perf_counter()
+        dataset = dict(get_or_compute(self.store, store_key('dataset', version), load_aggregates))
+        dataset['version'] = version
+        # Префиксные суммы по месяцам строятся за доли секунды и в общее хранилище не попадают
+        dataset['time_index'] = OperationsTimeIndex(dataset['operations_cube'])
+        # Таблицы SQL-слоя пересобираются до подмены, чтобы новый набор сразу читал свою версию
+        if self.query_backend is not None:
+            self.query_backend.ensure(version)
+        observe('refresh', time.perf_counter() - start)
+        self.last_refresh = time.time()
+        return dataset
+
+    def fetch_due(self):
+        return self.fetch_interval > 0 and (
+            self.last_fetch is None or time.time() - self.last_fetch >= self.fetch_interval
+        )
+
+    def fetch(self):
+        # У каждого воркера свой поток обновления, но выгрузку за интервал запускает только один из них:
+        # остальные подхватят её файлы обычной проверкой версии
+        # Неблокирующая блокировка: None значит, что выгрузку сейчас ведёт другой воркер
+        with file_lock(self.fetch_lock_path, blocking=False) as lock_file:
+            if lock_file is None:
+                return False
+            shared_fetch = read_fetch_time(lock_file)
+            if shared_fetch is not None and time.time() - shared_fetch < self.fetch_interval:
+                self.last_fetch = shared_fetch
+                return False
+            self.last_fetch = time.time()
+            run_fetch()
+            write_fetch_time(lock_file, self.last_fetch)
+            return True
+
+    def load_initial(self):
+        self.current = self.build(current_version())
+        self._ready.set()
+
+    def ready(self):
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def refresh_once(self):
+        fetched = self.fetch() if self.fetch_due() else False
+
+        version = current_version()
+        if version == self.current['version']:
+            self._seen_version = version
+            return False
+        # Файлы, изменённые не нашей выгрузкой, подхватываются только когда версия не меняется между проверками:
+        # так не читается недописанный CSV
+        if not fetched and version != self._seen_version:
+            self._seen_version = version
+            return False
+        self.current = self.build(version)
+        self._seen_version = version
+        return True
+
+    def run(self):
+        # До первой удачной сборки повторяет её каждые RETRY_SECONDS, затем проверяет файлы с check_interval
+        while True:
+            try:
+                if self.ready():
+                    self.refresh_once()
+                else:
+                    self.load_initial()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = repr(e)
+                print(f"Ошибка обновления данных: {e}")
+            if self.ready() and self.check_interval <= 0:
+                return
+            if self._stop.wait(self.check_interval if self.ready() else RETRY_SECONDS):
+                return
+
+    def start(self):
+        # Первая сборка тоже идёт в фоне, чтобы сервер начал отвечать сразу.
+        # Поток не переживает fork (gunicorn --preload): в новом процессе он запускается заново,
+        # а набор данных, собранный до fork, остаётся в силе
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._stop = threading.Event()
+            self._ready = threading.Event()
+            if self.current is not None:
+                self._ready.set()
+            self._thread = threading.Thread(target=self.run, name='dataset-refresher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self):
+        return {
+            'ready': self.ready(),
+            'version': self.current['version'] if self.current is not None else None,
+            'last_refresh': self.last_refresh,
+            'last_fetch': self.last_fetch,
+            'last_error': self.last_error,
+        }
@@ -0,0 +1,166 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from file_utils import tmp_path
+
+
+def store_key(*parts):
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+class MemoryStore:
+    # Хранилище внутри процесса; подходит для одного воркера и как замена Redis в тестах
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class FileStore:
+    # Общий для всех воркеров каталог с pickle-файлами, вытеснение давно не читанных при превышении размера
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                value = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            # Файл успел вытеснить другой воркер: прочитанное значение всё равно верное
+            pass
+        return value
+
+    def set(self, key, value):
+        path = self._path(key)
+        tmp = tmp_path(path)
+        with open(tmp, 'wb') as file:
+            pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.pkl'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, name))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total_bytes -= size
+
+
+class RedisStore:
+    # Принимает любой клиент с интерфейсом redis.Redis (get/set с ex); вытеснение по TTL и политике Redis
+    def __init__(self, client, prefix='invest_dashboard:', ttl=24 * 60 * 60):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return None
+        self.client.expire(self.prefix + key, self.ttl)
+        return pickle.loads(value)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), ex=self.ttl)
+
+
+def create_store(url, redis_client=None):
+    # redis_client подменяет настоящий клиент, например на имитацию внутри процесса
+    if url == 'memory':
+        return MemoryStore()
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        if redis_client is None:
+            import redis
+            redis_client = redis.Redis.from_url(url)
+        return RedisStore(redis_client)
+    if url.startswith('file://'):
+        url = url[len('file://'):]
+    return FileStore(url)
+
+
+# Вычисления, которые сейчас идут в этом процессе: ключ → Future с результатом
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def _reset_in_flight():
+    # Вычисления родителя в процессе после fork не завершатся: таблица и блокировка начинаются заново
+    global _in_flight_lock
+    _in_flight.clear()
+    _in_flight_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_in_flight)
+
+
+def get_or_compute(store, key, compute):
+    value = store.get(key)
+    if value is not None:
+        return value
+    # Callback одного выбора приходят параллельными запросами: первый считает, остальные ждут его результат
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        owner = future is None
+        if owner:
+            future = _in_flight[key] = Future()
+    if not owner:
+        return future.result()
+    try:
+        # Пока ждали блокировку, значение мог положить предыдущий владелец или другой воркер
+        value = store.get(key)
+        if value is None:
+            value = compute()
+            store.set(key, value)
+        future.set_result(value)
+        return value
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
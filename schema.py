@@ -0,0 +1,37 @@
+# Явные типы колонок CSV, чтобы pandas не выводил их заново при каждом чтении.
+# Повторяющиеся строки хранятся как category; суммы и цены остаются float64,
+# так как float32 не хранит копейки у сумм от сотни тысяч рублей
+OPERATIONS_DTYPES = {
+    'id': 'object',
+    'portfolio_id': 'category',
+    'portfolio_name': 'category',
+    'currency': 'category',
+    'amount': 'float64',
+    'type': 'category',
+    'payment': 'float64',
+    'figi': 'category',
+    'quantity': 'float64',
+}
+
+PORTFOLIO_DTYPES = {
+    'portfolio_id': 'category',
+    'portfolio_name': 'category',
+    'isin': 'object',
+    'ticker': 'category',
+    'name': 'category',
+    'type': 'category',
+    'sector': 'category',
+    'currency': 'category',
+    'quantity': 'float64',
+    'average_price': 'float64',
+    'current_price': 'float64',
+    'expected_yield': 'float64',
+}
+
+# Год операции после фильтрации по окну лет
+YEAR_DTYPE = 'int16'
+MONTH_DTYPE = 'int8'
+
+# Увеличивать при любом изменении схемы или подготовки данных: кэш будет пересобран
+SCHEMA_VERSION = 7
+
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+
+from data_processing import REPORTED_TYPES
+
+
+def month_number(year, month):
+    # Сквозной номер месяца: диапазон дат задаётся парой таких номеров
+    return year * 12 + month - 1
+
+
+class OperationsTimeIndex:
+    # Помесячный куб операций каждого счёта, отсортированный по месяцам, с префиксными суммами по типам.
+    # Границы диапазона находятся бинарным поиском, сумма за любой отрезок — разность двух префиксов
+    def __init__(self, operations_cube):
+        cube = operations_cube.assign(
+            number=month_number(operations_cube['year'].astype('int64'), operations_cube['month'].astype('int64')),
+            type=operations_cube['type'].astype(object)
+        )
+        self.types = [operation_type for operation_type in REPORTED_TYPES if operation_type in set(cube['type'])]
+        self.accounts = {}
+        for account, group in cube.groupby('portfolio_name', observed=True):
+            amounts = group.pivot_table(index='number', columns='type', values='amount', aggfunc='sum')
+            amounts = amounts.reindex(columns=self.types)
+            present = amounts.notna().to_numpy(dtype='int64')
+            zeros = np.zeros((1, len(self.types)))
+            self.accounts[account] = (
+                amounts.index.to_numpy(),
+                np.vstack([zeros, np.cumsum(amounts.fillna(0).to_numpy(), axis=0)]),
+                np.vstack([zeros, np.cumsum(present, axis=0)]),
+            )
+        numbers = cube['number']
+        self.bounds = (int(numbers.min()), int(numbers.max())) if len(numbers) else None
+
+    def account_range(self, account, start, end):
+        months, amount_prefix, count_prefix = self.accounts[account]
+        if start > end or not len(months):
+            return None
+        # Годы внутри диапазона, у каждого свои границы месяцев, обрезанные по start и end
+        years = np.arange(max(start, months[0]) // 12, min(end, months[-1]) // 12 + 1)
+        if not len(years):
+            return None
+        lower = np.searchsorted(months, np.maximum(years * 12, start), side='left')
+        upper = np.searchsorted(months, np.minimum(years * 12 + 11, end), side='right')
+        amounts = amount_prefix[upper] - amount_prefix[lower]
+        counts = count_prefix[upper] - count_prefix[lower]
+        year_index, type_index = np.nonzero(counts)
+        return pd.DataFrame({
+            'portfolio_name': account,
+            'year': years[year_index],
+            'type': np.array(self.types, dtype=object)[type_index],
+            'amount': amounts[year_index, type_index],
+        })
+
+    def range_cube(self, accounts, start, end):
+        # Куб по годам в том же виде, что и aggregate_operations, только за месяцы [start, end]
+        parts = [self.account_range(account, start, end) for account in accounts if account in self.accounts]
+        parts = [part for part in parts if part is not None]
+        if not parts:
+            return pd.DataFrame(columns=['portfolio_name', 'year', 'type', 'amount'])
+        return pd.concat(parts, ignore_index=True)
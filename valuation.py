@@ -0,0 +1,218 @@
+import numpy as np
+import pandas as pd
+
+from data_processing import DEPOSIT_TYPE, WITHDRAWAL_TYPE
+from xirr import xirr
+
+PRICES_PATH = 'data/prices.csv'
+
+# Направление изменения позиции по типу операции; количество в операциях всегда положительное
+POSITION_SIGNS = {
+    'Покупка ценных бумаг': 1,
+    'Покупка ЦБ с карты': 1,
+    'Продажа ценных бумаг': -1,
+    'Продажа ЦБ с карты': -1,
+    'Погашение облигации': -1,
+}
+# Внешние потоки денег: от них считаются доходности
+FLOW_SIGNS = {DEPOSIT_TYPE: 1, WITHDRAWAL_TYPE: -1}
+
+
+def to_day(dates):
+    dates = pd.to_datetime(dates)
+    if dates.dt.tz is not None:
+        dates = dates.dt.tz_convert(None)
+    return dates.dt.normalize()
+
+
+def load_price_history(path=PRICES_PATH):
+    # Файл цен закрытия: date, figi, close
+    prices = pd.read_csv(path, dtype={'figi': 'category', 'close': 'float64'})
+    prices['date'] = to_day(prices['date'])
+    return prices.pivot_table(index='date', columns='figi', values='close', aggfunc='last', observed=True)
+
+
+def time_weighted_return(values, flows):
+    # Дневная доходность без учёта внешних потоков: поток считается пришедшим в конце дня
+    values = np.asarray(values, dtype='float64')
+    flows = np.asarray(flows, dtype='float64')
+    previous = values[:-1]
+    valid = previous > 0
+    daily = (values[1:][valid] - flows[1:][valid]) / previous[valid]
+    return float(np.prod(daily) - 1) if daily.size else 0.0
+
+
+def append_days(previous, new):
+    # Дневные приращения (Series или DataFrame по инструментам), отсортированные по дню. Новые дни обычно идут
+    # после известных, кроме повторно присланного дня отметки: он складывается с последней строкой,
+    # остальное дописывается в конец одним массивом, без выравнивания всей истории
+    if previous is None or previous.empty:
+        return new
+    last_day = previous.index[-1]
+    if new.index[0] < last_day:
+        return previous.add(new, fill_value=0).sort_index().fillna(0)
+    if isinstance(previous, pd.DataFrame) and not new.columns.equals(previous.columns):
+        columns = previous.columns.union(new.columns)
+        previous = previous.reindex(columns=columns, fill_value=0)
+        new = new.reindex(columns=columns, fill_value=0)
+    overlap = int(new.index[0] == last_day)
+    new_values = new.to_numpy()
+    values = np.concatenate([previous.to_numpy(), new_values[overlap:]])
+    if overlap:
+        values[len(previous) - 1] += new_values[0]
+    index = previous.index.append(new.index[overlap:])
+    if isinstance(previous, pd.DataFrame):
+        return pd.DataFrame(values, index=index, columns=previous.columns)
+    return pd.Series(values, index=index, name=previous.name)
+
+
+class ValuationEngine:
+    # Позиции и деньги по счёту хранятся как дневные приращения; при новых операциях
+    # пересчитываются только затронутые счета и только начиная с самой ранней новой даты
+    def __init__(self, prices):
+        self.prices = prices.sort_index()
+        self._position_deltas = {}
+        self._holdings = {}
+        self._cash_deltas = {}
+        self._flows = {}
+        self._curves = {}
+        # Счёт → (последний загруженный день, id операций этого дня)
+        self._boundary_ids = {}
+
+    @classmethod
+    def from_files(cls, operations, prices_path=PRICES_PATH):
+        engine = cls(load_price_history(prices_path))
+        engine.add_operations(operations)
+        return engine
+
+    @property
+    def accounts(self):
+        return list(self._cash_deltas)
+
+    def _unseen(self, operations, day):
+        # Инкрементальная синхронизация заново присылает операции дня последней загрузки, поэтому по каждому
+        # счёту хранятся только id операций этого дня. Проверяются лишь строки не раньше него, как и повторы
+        # внутри одной порции, так что время зависит от размера порции, а не от всей истории
+        if 'id' not in operations.columns:
+            return np.ones(len(operations), dtype=bool)
+        names = operations['portfolio_name'].astype(object).to_numpy()
+        ids = operations['id'].astype(object)
+        seen = pd.DataFrame({'portfolio_name': names, 'id': ids}).duplicated().to_numpy() & ids.notna().to_numpy()
+        day = day.to_numpy()
+        for account, (last_day, known) in self._boundary_ids.items():
+            rows = (names == account) & (day >= last_day)
+            if rows.any():
+                seen[rows] |= ids[rows].isin(known).to_numpy()
+
+        fresh = pd.DataFrame({'portfolio_name': names, 'day': day, 'id': ids.to_numpy()})[~seen].dropna()
+        for account, account_rows in fresh.groupby('portfolio_name', sort=False):
+            last_day = account_rows['day'].max()
+            boundary = self._boundary_ids.get(account)
+            if boundary is not None and last_day < boundary[0]:
+                continue
+            ids_on_day = set(account_rows.loc[account_rows['day'] == last_day, 'id'])
+            if boundary is not None and last_day == boundary[0]:
+                ids_on_day |= boundary[1]
+            self._boundary_ids[account] = (last_day, ids_on_day)
+        return ~seen
+
+    def add_operations(self, operations):
+        operations = operations[operations['date'].notna()]
+        day = to_day(operations['date'])
+        unseen = self._unseen(operations, day)
+        operations, day = operations[unseen], day[unseen]
+        position_sign = operations['type'].map(POSITION_SIGNS).astype('float64').fillna(0)
+        flow_sign = operations['type'].map(FLOW_SIGNS).astype('float64').fillna(0)
+        frame = pd.DataFrame({
+            'portfolio_name': operations['portfolio_name'].astype(object),
+            'day': day,
+            'figi': operations['figi'].astype(object),
+            'quantity': operations['quantity'].fillna(0).to_numpy() * position_sign,
+            'payment': operations['payment'].fillna(0).to_numpy(),
+            'flow': operations['amount'].to_numpy() * flow_sign,
+        })
+
+        trades = frame[(frame['quantity'] != 0) & frame['figi'].notna()]
+        position_deltas = trades.pivot_table(index=['portfolio_name', 'day'], columns='figi', values='quantity',
+                                             aggfunc='sum', fill_value=0)
+        cash_deltas = frame.groupby(['portfolio_name', 'day'])[['payment', 'flow']].sum()
+
+        for account, account_cash in cash_deltas.groupby(level='portfolio_name'):
+            account_cash = account_cash.droplevel('portfolio_name')
+            self._cash_deltas[account] = append_days(self._cash_deltas.get(account), account_cash['payment'])
+            self._flows[account] = append_days(self._flows.get(account), account_cash['flow'])
+            self._curves.pop(account, None)
+
+            if account in position_deltas.index.get_level_values('portfolio_name'):
+                new_deltas = position_deltas.loc[account]
+                new_deltas = new_deltas.loc[:, (new_deltas != 0).any()]
+                self._update_holdings(account, new_deltas)
+
+    def _update_holdings(self, account, new_deltas):
+        previous = self._position_deltas.get(account)
+        deltas = append_days(previous, new_deltas)
+        self._position_deltas[account] = deltas
+
+        holdings = self._holdings.get(account)
+        start = new_deltas.index[0]
+        if holdings is None or start <= holdings.index[0]:
+            self._holdings[account] = deltas.cumsum()
+            return
+        # До первой новой даты позиции не меняются, дальше накапливаются от последнего известного состояния
+        position = deltas.index.searchsorted(start)
+        before = holdings.iloc[:position]
+        if not before.columns.equals(deltas.columns):
+            before = before.reindex(columns=deltas.columns, fill_value=0)
+        before = before.to_numpy()
+        after = before[-1] + np.cumsum(deltas.to_numpy()[position:], axis=0)
+        self._holdings[account] = pd.DataFrame(np.concatenate([before, after]), index=deltas.index,
+                                               columns=deltas.columns)
+
+    def _account_curve(self, account):
+        if account in self._curves:
+            return self._curves[account]
+
+        cash_deltas = self._cash_deltas[account]
+        end = max(cash_deltas.index[-1], self.prices.index[-1]) if len(self.prices) else cash_deltas.index[-1]
+        dates = pd.date_range(cash_deltas.index[0], end, freq='D')
+
+        holdings_value = np.zeros(len(dates))
+        holdings = self._holdings.get(account)
+        if holdings is not None and not holdings.empty:
+            daily_holdings = holdings.reindex(dates, method='ffill').fillna(0).to_numpy()
+            # Цена до первой котировки берётся по первой известной, после последней — по последней
+            prices = self.prices.reindex(columns=holdings.columns).reindex(dates, method='ffill').bfill()
+            holdings_value = np.nansum(daily_holdings * prices.to_numpy(), axis=1)
+
+        cash = cash_deltas.reindex(dates, fill_value=0).cumsum().to_numpy()
+        curve = pd.DataFrame({
+            'holdings_value': holdings_value,
+            'cash': cash,
+            'value': holdings_value + cash,
+            'flow': self._flows[account].reindex(dates, fill_value=0).to_numpy(),
+        }, index=pd.Index(dates, name='date'))
+        self._curves[account] = curve
+        return curve
+
+    def equity_curve(self, accounts=None):
+        accounts = self.accounts if accounts is None else [account for account in accounts
+                                                           if account in self._cash_deltas]
+        if not accounts:
+            return pd.DataFrame(columns=['holdings_value', 'cash', 'value', 'flow'])
+        curves = [self._account_curve(account) for account in accounts]
+        if len(curves) == 1:
+            return curves[0]
+        return pd.concat(curves).groupby(level='date').sum().sort_index()
+
+    def returns(self, accounts=None):
+        curve = self.equity_curve(accounts)
+        if curve.empty:
+            return {'twr': 0.0, 'mwr': np.nan}
+        flows = curve[curve['flow'] != 0]
+        # Для инвестора пополнение — отток, вывод и итоговая стоимость — приток
+        cash_flow_dates = flows.index.append(curve.index[-1:])
+        cash_flow_amounts = np.append(-flows['flow'].to_numpy(), curve['value'].iloc[-1])
+        return {
+            'twr': time_weighted_return(curve['value'], curve['flow']),
+            'mwr': xirr(cash_flow_dates, cash_flow_amounts),
+        }
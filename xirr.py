@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+DAYS_IN_YEAR = 365.0
+MIN_RATE = -0.9999
+MAX_RATE = 1e3
+
+
+def _npv(rate, times, amounts):
+    discount = (1 + rate[:, None]) ** -times
+    return (amounts * discount).sum(axis=1), (-times * amounts * discount / (1 + rate[:, None])).sum(axis=1)
+
+
+def _bisect(times, amounts, iterations=200):
+    low = np.full(len(amounts), MIN_RATE)
+    high = np.full(len(amounts), MAX_RATE)
+    low_value, _ = _npv(low, times, amounts)
+    for _ in range(iterations):
+        middle = (low + high) / 2
+        value, _ = _npv(middle, times, amounts)
+        same_sign = np.sign(value) == np.sign(low_value)
+        low = np.where(same_sign, middle, low)
+        low_value = np.where(same_sign, value, low_value)
+        high = np.where(same_sign, high, middle)
+    return (low + high) / 2
+
+
+def xirr_batch(times, amounts, guess=0.1, tolerance=1e-10, max_iterations=50):
+    # Строка матрицы — один набор потоков; times в годах от первого потока, пустые ячейки заполнены нулями.
+    # Метод Ньютона идёт сразу по всем строкам, несошедшиеся строки добиваются бисекцией
+    times = np.asarray(times, dtype='float64')
+    amounts = np.asarray(amounts, dtype='float64')
+    solvable = (amounts > 0).any(axis=1) & (amounts < 0).any(axis=1)
+
+    rate = np.full(len(amounts), guess)
+    converged = ~solvable
+    with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+        for _ in range(max_iterations):
+            active = np.flatnonzero(~converged)
+            if not active.size:
+                break
+            value, derivative = _npv(rate[active], times[active], amounts[active])
+            step = np.where(derivative != 0, value / derivative, np.nan)
+            rate[active] = np.clip(rate[active] - step, MIN_RATE, MAX_RATE)
+            converged[active] = np.abs(step) < tolerance
+
+        failed = solvable & (~converged | ~np.isfinite(rate))
+        if failed.any():
+            rate[failed] = _bisect(times[failed], amounts[failed])
+        # Если корня нет внутри [MIN_RATE, MAX_RATE], ставка упирается в границу с ненулевой NPV
+        residual, _ = _npv(rate, times, amounts)
+        rooted = np.abs(residual) <= 1e-6 * np.abs(amounts).sum(axis=1)
+
+    rate[~solvable | ~rooted] = np.nan
+    return rate
+
+
+def xirr_by_group(groups, dates, amounts):
+    # Потоки в длинном формате (группа, дата, сумма) раскладываются в матрицу группа × поток
+    codes, uniques = pd.factorize(np.asarray(groups), sort=True)
+    if not len(uniques):
+        return pd.Series(dtype='float64')
+    days = pd.DatetimeIndex(dates).to_numpy().astype('datetime64[D]').astype('int64')
+    order = np.lexsort((days, codes))
+    codes, days, amounts = codes[order], days[order], np.asarray(amounts, dtype='float64')[order]
+
+    counts = np.bincount(codes, minlength=len(uniques))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    positions = np.arange(len(codes)) - starts[codes]
+
+    times = np.zeros((len(uniques), counts.max()))
+    amount_matrix = np.zeros_like(times)
+    times[codes, positions] = (days - days[starts][codes]) / DAYS_IN_YEAR
+    amount_matrix[codes, positions] = amounts
+    return pd.Series(xirr_batch(times, amount_matrix), index=uniques)
+
+
+def xirr(dates, amounts):
+    return xirr_by_group(np.zeros(len(amounts), dtype='int64'), dates, amounts).iloc[0]